@@ -0,0 +1,406 @@
+# bank_loader.py — загрузка банка вопросов из внешнего файла
+# Форматы: JSON Lines (один вопрос на строку) или SQLite (таблица questions).
+# Маленький банк компилируется целиком, большой — лениво: при загрузке
+# строится только индекс смещений, вопрос читается (os.pread по открытому
+# дескриптору) и собирается при первом обращении.
+# BankHolder следит за файлом и атомарно подменяет банк; старые версии живут,
+# пока на них могут ссылаться начатые тесты.
+#
+# Кэш (cache_dir): скомпилированный банк из questions.py и индексы ленивых
+# банков сохраняются через marshal под хешем содержимого файла. При следующем
+# запуске с тем же файлом разбор и проверка пропускаются. Целиком загружаемый
+# JSONL/SQLite не кэшируется: json разбирает его не медленнее, чем marshal читает.
+#
+# Перевести questions.py в JSON Lines:
+#   python bank_loader.py questions.py questions.jsonl
+
+import asyncio
+import glob
+import hashlib
+import importlib.util
+import json
+import logging
+import marshal
+import os
+import sqlite3
+import time
+from array import array
+from collections import OrderedDict
+
+from question_bank import (
+    CompiledQuestion,
+    QuestionBankError,
+    compile_bank,
+    compile_question,
+    validate_question,
+)
+
+logger = logging.getLogger(__name__)
+
+# Файлы больше этого размера грузим лениво (QUESTIONS_LAZY=auto)
+LAZY_THRESHOLD = 8 * 1024 * 1024
+CACHE_SIZE = 4096
+# Меняется при изменении формата кэша или компиляции вопросов
+CACHE_FORMAT = 2
+
+
+# === Ленивый банк: индекс + кэш скомпилированных вопросов ===
+class LazyBank:
+    def __init__(self, cache_size=CACHE_SIZE):
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+
+    def __getitem__(self, position):
+        q = self._cache.get(position)
+        if q is None:
+            q = compile_question(self._read(position), position + 1)
+            self._cache[position] = q
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(position)
+        return q
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    def _read(self, position):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonlLazyBank(LazyBank):
+    # Не mmap: если файл перезапишут на месте (cp поверх), чтение обрезанного
+    # отображения убивает процесс SIGBUS, а pread вернёт ошибку
+    READ_SIZE = 4096
+
+    def __init__(self, path, cache_size=CACHE_SIZE, offsets=None):
+        super().__init__(cache_size)
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY)
+        self._signature = _fd_signature(self._fd)
+        # Смещения начала строк с вопросами: 8 байт на вопрос (готовые — из кэша)
+        self._offsets = offsets
+        if offsets is None:
+            self._offsets = array("Q")
+            with open(path, "rb") as f:
+                for offset, raw in _iter_jsonl(f, validate=True):
+                    self._offsets.append(offset)
+        if not self._offsets:
+            os.close(self._fd)
+            raise QuestionBankError("Банк вопросов пуст")
+
+    def __len__(self):
+        return len(self._offsets)
+
+    @property
+    def index(self):
+        return self._offsets
+
+    def _read(self, position):
+        # Файл изменили на месте (тот же inode): смещения указывают в чужие строки
+        if _fd_signature(self._fd) != self._signature:
+            raise QuestionBankError(f"{self.path} изменён на месте; заменяйте файл атомарно (rename)")
+        start = self._offsets[position]
+        line = b""
+        size = self.READ_SIZE
+        while True:
+            chunk = os.pread(self._fd, size, start + len(line))
+            end = chunk.find(b"\n")
+            if end != -1:
+                line += chunk[:end]
+                break
+            line += chunk
+            if len(chunk) < size:
+                # Последняя строка без перевода строки
+                break
+            size *= 2
+        return json.loads(line)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class SqliteLazyBank(LazyBank):
+    def __init__(self, path, cache_size=CACHE_SIZE, ids=None):
+        super().__init__(cache_size)
+        self._db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._ids = ids
+        if ids is None:
+            self._ids = array("q")
+            for position, row in enumerate(_iter_sqlite(self._db), start=1):
+                validate_question(row, position)
+                self._ids.append(row["id"])
+        if not self._ids:
+            raise QuestionBankError("Банк вопросов пуст")
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def index(self):
+        return self._ids
+
+    def _read(self, position):
+        cursor = self._db.execute(
+            "SELECT id, question, options, correct, explanation FROM questions WHERE id = ?",
+            (self._ids[position],),
+        )
+        return _row_to_dict(cursor.fetchone())
+
+    def close(self):
+        self._db.close()
+
+
+# === Чтение файлов ===
+def _fd_signature(fd):
+    st = os.fstat(fd)
+    return st.st_size, st.st_mtime_ns
+
+
+def _iter_jsonl(lines, validate=False):
+    # lines — файл в режиме rb (или другие строки bytes); пустые строки и комментарии (#) пропускаем
+    offset = 0
+    position = 0
+    for line in lines:
+        stripped = line.strip()
+        if stripped and not stripped.startswith(b"#"):
+            position += 1
+            try:
+                raw = json.loads(stripped)
+            except ValueError as e:
+                raise QuestionBankError(f"Вопрос #{position}: некорректный JSON ({e})") from e
+            if validate:
+                validate_question(raw, position)
+            yield offset, raw
+        offset += len(line)
+
+
+def _row_to_dict(row):
+    id_, question, options, correct, explanation = row
+    return {
+        "id": id_,
+        "question": question,
+        "options": json.loads(options),
+        "correct": correct,
+        "explanation": explanation,
+    }
+
+
+def _iter_sqlite(db):
+    cursor = db.execute("SELECT id, question, options, correct, explanation FROM questions ORDER BY id")
+    for row in cursor:
+        yield _row_to_dict(row)
+
+
+def _is_sqlite(path):
+    with open(path, "rb") as f:
+        return f.read(16) == b"SQLite format 3\x00"
+
+
+# === Кэш скомпилированного банка ===
+def _digest(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _cache_file(cache_dir, path, digest, kind):
+    return os.path.join(cache_dir, f"{os.path.basename(path)}.{digest}.{kind}")
+
+
+def _read_cache(cache_dir, path, digest, kind):
+    try:
+        with open(_cache_file(cache_dir, path, digest, kind), "rb") as f:
+            fmt, payload = marshal.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, EOFError, TypeError) as e:
+        logger.warning("Кэш банка %s не прочитан: %s", path, e)
+        return None
+    if fmt != CACHE_FORMAT:
+        return None
+    return payload
+
+
+def _write_cache(cache_dir, path, digest, kind, payload):
+    target = _cache_file(cache_dir, path, digest, kind)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(target + ".tmp", "wb") as f:
+            marshal.dump((CACHE_FORMAT, payload), f)
+        os.replace(target + ".tmp", target)
+        # Кэши прошлых версий файла больше не нужны
+        for old in glob.glob(_cache_file(cache_dir, glob.escape(path), "*", kind)):
+            if old != target:
+                os.remove(old)
+    except OSError as e:
+        # Без кэша бот работает, просто запускается медленнее
+        logger.warning("Кэш банка %s не записан: %s", path, e)
+
+
+def _bank_from_cache(rows):
+    return tuple(CompiledQuestion.from_cache(*row) for row in rows)
+
+
+def _bank_to_cache(bank):
+    return tuple(q.to_cache() for q in bank)
+
+
+def load_bank(path, lazy="auto", cache_dir=None):
+    size = os.path.getsize(path)
+    if lazy == "auto":
+        lazy = size > LAZY_THRESHOLD
+    else:
+        lazy = lazy in (True, "1", "true", "yes")
+
+    sqlite = _is_sqlite(path)
+    if not (lazy and cache_dir):
+        return _load_bank(path, lazy, sqlite)
+
+    # Ленивый банк: из кэша берём готовый индекс (id строк или смещения в файле)
+    digest = _digest(path)
+    kind = "ids" if sqlite else "offsets"
+    payload = _read_cache(cache_dir, path, digest, kind)
+    if payload is not None:
+        index = array("q" if sqlite else "Q")
+        index.frombytes(payload)
+        return SqliteLazyBank(path, ids=index) if sqlite else JsonlLazyBank(path, offsets=index)
+    bank = _load_bank(path, lazy, sqlite)
+    _write_cache(cache_dir, path, digest, kind, bank.index.tobytes())
+    return bank
+
+
+def _load_bank(path, lazy, sqlite):
+    if sqlite:
+        if lazy:
+            return SqliteLazyBank(path)
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return compile_bank(list(_iter_sqlite(db)))
+        finally:
+            db.close()
+
+    if lazy:
+        return JsonlLazyBank(path)
+    with open(path, "rb") as f:
+        return compile_bank([raw for _, raw in _iter_jsonl(f)])
+
+
+def _exec_questions(path):
+    spec = importlib.util.spec_from_file_location("questions", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.questions
+
+
+def load_python_bank(path, cache_dir=None):
+    # questions.py со списком questions; при попадании в кэш модуль даже не выполняется
+    digest = _digest(path) if cache_dir else None
+    if digest is not None:
+        payload = _read_cache(cache_dir, path, digest, "bank")
+        if payload is not None:
+            return _bank_from_cache(payload)
+    bank = compile_bank(_exec_questions(path))
+    if digest is not None:
+        _write_cache(cache_dir, path, digest, "bank", _bank_to_cache(bank))
+    return bank
+
+
+# === Версии банка и горячая перезагрузка ===
+class BankHolder:
+    def __init__(self, bank, path=None, lazy="auto", retain=6 * 3600, clock=time.monotonic, cache_dir=None):
+        self.path = path
+        self.lazy = lazy
+        self.cache_dir = cache_dir
+        # Сколько держать старую версию после замены (не меньше TTL сессии)
+        self.retain = retain
+        self._clock = clock
+        self.version = 1
+        self._versions = {1: bank}
+        self._retired = {}   # версия -> когда её сменили
+        self._signature = self._stat()
+
+    @property
+    def current(self):
+        return self._versions[self.version]
+
+    def get(self, version):
+        # Неизвестная версия — сессия из прошлого запуска процесса (SQLite/снимок):
+        # номера вопросов стабильны, пока вопросы только дописывают в конец
+        bank = self._versions.get(version)
+        return bank if bank is not None else self.current
+
+    def swap(self, bank):
+        now = self._clock()
+        self._retired[self.version] = now
+        self.version += 1
+        self._versions[self.version] = bank
+        for version, retired in list(self._retired.items()):
+            if now - retired > self.retain:
+                old = self._versions.pop(version)
+                del self._retired[version]
+                if isinstance(old, LazyBank):
+                    old.close()
+        return self.version
+
+    def _stat(self):
+        if not self.path:
+            return None
+        signature = []
+        for name in (self.path, self.path + "-wal"):
+            try:
+                st = os.stat(name)
+            except FileNotFoundError:
+                signature.append(None)
+            else:
+                signature.append((st.st_ino, st.st_mtime_ns, st.st_size))
+        return tuple(signature)
+
+    async def reload_if_changed(self):
+        signature = self._stat()
+        if signature == self._signature:
+            return False
+        previous, self._signature = self._signature, signature
+        if (isinstance(self.current, JsonlLazyBank) and previous[0] and signature[0]
+                and previous[0][0] == signature[0][0]):
+            logger.warning("Банк вопросов %s изменён на месте: начатые на прошлой версии тесты "
+                           "не смогут читать вопросы; заменяйте файл атомарно (rename)", self.path)
+        try:
+            # Разбор и проверка — в отдельном потоке, чтобы не блокировать бота
+            bank = await asyncio.to_thread(load_bank, self.path, self.lazy, self.cache_dir)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            # Ошибка в файле не должна ломать работающий банк
+            logger.error("Банк вопросов %s не перезагружен: %s", self.path, e)
+            return False
+        version = self.swap(bank)
+        logger.info("Банк вопросов перезагружен: версия %d, %d вопросов", version, len(bank))
+        return True
+
+    async def watch(self, interval=5.0):
+        # Файл лучше заменять атомарно (запись во временный + rename): ленивые
+        # версии читают старый файл по открытому дескриптору, и правка на месте
+        # ломает тесты, начатые на них (см. JsonlLazyBank)
+        while True:
+            await asyncio.sleep(interval)
+            await self.reload_if_changed()
+
+
+# === Конвертер questions.py → JSON Lines ===
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3:
+        print("Использование: python bank_loader.py questions.py questions.jsonl")
+        sys.exit(1)
+    questions = _exec_questions(sys.argv[1])
+    compile_bank(questions)
+    with open(sys.argv[2], "w", encoding="utf-8") as out:
+        for q in questions:
+            out.write(json.dumps(q, ensure_ascii=False) + "\n")
+    print(f"✅ Записано {len(questions)} вопросов в {sys.argv[2]}")
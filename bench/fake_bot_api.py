@@ -0,0 +1,115 @@
+# bench/fake_bot_api.py — локальная замена Bot API для нагрузочных тестов
+# Понимает getMe, getUpdates, setWebhook/deleteWebhook, sendMessage,
+# editMessageText, editMessageReplyMarkup, answerCallbackQuery.
+# Задержка ответа и доля ответов 429 настраиваются.
+
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from urllib.parse import parse_qsl
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+
+class FakeBotApi:
+    def __init__(self, latency=0.0, jitter=0.0, rate_429=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.injected_429 = 0
+        # Всё, что бот отправил или отредактировал, — по чатам, для симулированных пользователей
+        self.outputs = defaultdict(asyncio.Queue)
+        self._updates = asyncio.Queue()
+        self._message_ids = itertools.count(1000)
+        self._update_ids = itertools.count(1)
+        self.app = Starlette(routes=[
+            Route("/bot{token}/{method}", self.handle, methods=["GET", "POST"]),
+        ])
+
+    # === Входящие обновления (для режима polling) ===
+    def make_update(self, payload):
+        return {"update_id": next(self._update_ids), **payload}
+
+    def push_update(self, update):
+        self._updates.put_nowait(update)
+
+    # === HTTP ===
+    async def handle(self, request):
+        method = request.path_params["method"]
+        if request.headers.get("content-type", "").startswith("application/json"):
+            params = await request.json()
+        else:
+            # PTB шлёт параметры как application/x-www-form-urlencoded
+            params = dict(parse_qsl((await request.body()).decode()))
+        self.calls[method] += 1
+
+        if method != "getUpdates":
+            if self.latency or self.jitter:
+                await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+            if self.rate_429 and random.random() < self.rate_429:
+                self.injected_429 += 1
+                return JSONResponse({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }, status_code=429)
+
+        handler = getattr(self, "api_" + method.lower(), None)
+        result = await handler(params) if handler else True
+        return JSONResponse({"ok": True, "result": result})
+
+    # === Методы Bot API ===
+    async def api_getme(self, params):
+        return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+    async def api_getupdates(self, params):
+        timeout = float(params.get("timeout", 0) or 0)
+        limit = int(params.get("limit", 100) or 100)
+        try:
+            first = await asyncio.wait_for(self._updates.get(), timeout) if timeout else self._updates.get_nowait()
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
+            return []
+        batch = [first]
+        while len(batch) < limit and not self._updates.empty():
+            batch.append(self._updates.get_nowait())
+        return batch
+
+    async def api_setwebhook(self, params):
+        return True
+
+    async def api_deletewebhook(self, params):
+        return True
+
+    async def api_answercallbackquery(self, params):
+        return True
+
+    def _message(self, params, message_id):
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }
+        markup = params.get("reply_markup")
+        if markup:
+            message["reply_markup"] = json.loads(markup) if isinstance(markup, str) else markup
+        self.outputs[chat_id].put_nowait(message)
+        return message
+
+    async def api_sendmessage(self, params):
+        return self._message(params, next(self._message_ids))
+
+    async def api_editmessagetext(self, params):
+        return self._message(params, int(params["message_id"]))
+
+    async def api_editmessagereplymarkup(self, params):
+        return True
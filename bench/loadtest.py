@@ -0,0 +1,281 @@
+# bench/loadtest.py — нагрузочный тест бота на локальном Bot API
+# Запускает FakeBotApi, поднимает настоящие хендлеры из bot.py и прогоняет
+# N симулированных пользователей: /start → 20 ответов (ans_* / next) → итоги.
+#
+# Пример (из корня репозитория):
+#   python -m bench.loadtest --users 500 --latency 0.03 --rate-429 0.01
+#   python -m bench.loadtest --users 500 --workers 4   # маршрутизатор + 4 процесса
+#
+# Отчёт: обновлений/сек, p50/p95/p99 задержки "обновление → ответ бота",
+# запросов к Bot API на один пройденный тест, пиковый RSS.
+
+import argparse
+import asyncio
+import os
+import random
+import resource
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import uvicorn
+
+from bench.fake_bot_api import FakeBotApi
+
+TOKEN = "123456:BENCH"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота")
+    parser.add_argument("--users", type=int, default=100, help="сколько пользователей проходит тест")
+    parser.add_argument("--ramp", type=float, default=1.0, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument("--think", type=float, default=0.0, help="пауза пользователя перед ответом, сек")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа Bot API, сек")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, сек")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429 (0..1)")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--port", type=int, default=8099, help="порт фальшивого Bot API")
+    parser.add_argument("--timeout", type=float, default=60.0, help="сколько ждать ответа бота, сек")
+    parser.add_argument("--chat-rate", type=float, help="OUTBOX_CHAT_RATE для бота (по умолчанию из окружения)")
+    parser.add_argument("--global-rate", type=float, help="OUTBOX_GLOBAL_RATE для бота (по умолчанию из окружения)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="больше 1 — бот в отдельных процессах за маршрутизатором (режим webhook)")
+    return parser.parse_args()
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def _user(uid):
+    return {"id": uid, "is_bot": False, "first_name": f"user{uid}"}
+
+
+def start_update(uid):
+    return {"message": {
+        "message_id": 1,
+        "date": int(time.time()),
+        "chat": {"id": uid, "type": "private"},
+        "from": _user(uid),
+        "text": "/start",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+    }}
+
+
+def callback_update(uid, message, data, seq):
+    return {"callback_query": {
+        "id": f"{uid}-{seq}",
+        "chat_instance": str(uid),
+        "from": _user(uid),
+        "data": data,
+        "message": {
+            "message_id": message["message_id"],
+            "date": message["date"],
+            "chat": message["chat"],
+            "text": message.get("text", ""),
+        },
+    }}
+
+
+# === Симулированный пользователь ===
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.updates = 0
+        self.completed = 0
+        self.failed = 0
+
+
+async def simulate_user(uid, api, deliver, stats, args):
+    outputs = api.outputs[uid]
+
+    async def send(payload):
+        stats.updates += 1
+        sent = time.perf_counter()
+        await deliver(api.make_update(payload))
+        # Ждём ответ с клавиатурой (приветствие без кнопок пропускаем)
+        while True:
+            message = await asyncio.wait_for(outputs.get(), args.timeout)
+            if message.get("reply_markup"):
+                stats.latencies.append(time.perf_counter() - sent)
+                return message
+
+    try:
+        message = await send(start_update(uid))
+        for seq in range(1, 100):
+            buttons = [b for row in message["reply_markup"]["inline_keyboard"] for b in row]
+            data = [b["callback_data"] for b in buttons if "callback_data" in b]
+            if any(d.startswith("restart") for d in data):
+                stats.completed += 1
+                return
+            if args.think:
+                await asyncio.sleep(random.uniform(0, 2 * args.think))
+            choice = next((d for d in data if d.startswith("next")), None) or random.choice(data)
+            message = await send(callback_update(uid, message, choice, seq))
+        stats.failed += 1
+    except asyncio.TimeoutError:
+        stats.failed += 1
+
+
+# === Запуск ===
+async def run(args):
+    # Модуль бота читает настройки при импорте — выставляем их заранее
+    if args.chat_rate is not None:
+        os.environ["OUTBOX_CHAT_RATE"] = str(args.chat_rate)
+    if args.global_rate is not None:
+        os.environ["OUTBOX_GLOBAL_RATE"] = str(args.global_rate)
+    os.environ.setdefault("BOT_API_HTTP2", "0")
+    # Журнал событий и рейтинг бенчмарка не смешиваем с рабочими
+    scratch = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("EVENTS_DIR", os.path.join(scratch, "events"))
+    os.environ.setdefault("LEADERBOARD_DB", os.path.join(scratch, "leaderboard.db"))
+    if args.workers > 1:
+        await run_cluster(args)
+        return
+    import bot
+    from transport import build_requests
+    from web import create_web_app
+
+    api = FakeBotApi(args.latency, args.jitter, args.rate_429, args.retry_after)
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=args.port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    request, get_updates_request = build_requests()
+    application = bot.build_application(
+        TOKEN,
+        request=request,
+        get_updates_request=get_updates_request,
+        base_url=f"http://127.0.0.1:{args.port}/bot",
+    )
+
+    stats = Stats()
+    async with application:
+        if args.mode == "polling":
+            await application.updater.start_polling(poll_interval=0, timeout=1)
+
+            async def deliver(update):
+                api.push_update(update)
+        else:
+            import httpx
+            web_app = create_web_app(application, webhook_path=bot.WEBHOOK_PATH)
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=web_app), base_url="http://bot")
+
+            async def deliver(update):
+                await client.post(bot.WEBHOOK_PATH, json=update)
+
+        await application.start()
+        api.calls.clear()
+
+        elapsed = await simulate_all(args, api, deliver, stats)
+
+        if application.updater.running:
+            await application.updater.stop()
+        await application.stop()
+        await bot.outbox.stop()
+        await bot.quizzes.close()
+    server.should_exit = True
+    await server_task
+
+    report(args, api, stats, elapsed, request.stats())
+
+
+async def simulate_all(args, api, deliver, stats):
+    started = time.perf_counter()
+    tasks = []
+    for i in range(args.users):
+        tasks.append(asyncio.create_task(simulate_user(100000 + i, api, deliver, stats, args)))
+        if args.ramp:
+            await asyncio.sleep(args.ramp / args.users)
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - started
+
+
+# === Несколько процессов: bot.py с WORKERS=N, обновления идут через маршрутизатор ===
+async def run_cluster(args):
+    import httpx
+
+    api = FakeBotApi(args.latency, args.jitter, args.rate_429, args.retry_after)
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=args.port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    router_port = args.port + 1
+    db = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+    env = dict(
+        os.environ,
+        BOT_TOKEN=TOKEN,
+        BOT_MODE="webhook",
+        WORKERS=str(args.workers),
+        PORT=str(router_port),
+        WORKER_BASE_PORT=str(router_port + 1),
+        WEBHOOK_URL="http://127.0.0.1",
+        BOT_API_BASE_URL=f"http://127.0.0.1:{args.port}/bot",
+        SESSION_STORE=os.environ.get("SESSION_STORE", "shared"),
+        SESSION_DB=db,
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    router = subprocess.Popen([sys.executable, os.path.join(root, "bot.py")], env=env, cwd=root)
+
+    client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{router_port}", timeout=args.timeout)
+    # Ждём маршрутизатор и всех воркеров
+    for port in range(router_port, router_port + args.workers + 1):
+        while True:
+            try:
+                await client.get(f"http://127.0.0.1:{port}/")
+                break
+            except httpx.HTTPError:
+                await asyncio.sleep(0.1)
+    api.calls.clear()
+
+    async def deliver(update):
+        await client.post("/telegram", json=update)
+
+    stats = Stats()
+    try:
+        elapsed = await simulate_all(args, api, deliver, stats)
+    finally:
+        router.send_signal(signal.SIGTERM)
+        await asyncio.to_thread(router.wait)
+        await client.aclose()
+        server.should_exit = True
+        await server_task
+        os.unlink(db)
+
+    report(args, api, stats, elapsed, "в процессах воркеров")
+
+
+def report(args, api, stats, elapsed, pool_stats):
+    calls = {k: v for k, v in api.calls.items() if k not in ("getUpdates", "getMe")}
+    total_calls = sum(calls.values())
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    lat = stats.latencies
+    mode = f"webhook, воркеров: {args.workers}" if args.workers > 1 else args.mode
+    print(f"Пользователей: {args.users}, режим: {mode}, завершили: {stats.completed}, сбоев: {stats.failed}")
+    print(f"Время: {elapsed:.2f} с, обновлений: {stats.updates}, {stats.updates / elapsed:.1f} обновлений/с")
+    if lat:
+        print(
+            f"Обновление → ответ: p50 {percentile(lat, 0.5) * 1000:.1f} мс, "
+            f"p95 {percentile(lat, 0.95) * 1000:.1f} мс, p99 {percentile(lat, 0.99) * 1000:.1f} мс, "
+            f"среднее {statistics.fmean(lat) * 1000:.1f} мс"
+        )
+    per_quiz = total_calls / stats.completed if stats.completed else 0
+    print(f"Запросов к Bot API: {total_calls} ({per_quiz:.1f} на пройденный тест), из них 429: {api.injected_429}")
+    for method, count in sorted(calls.items()):
+        print(f"  {method}: {count}")
+    print(f"Пул соединений: {pool_stats}")
+    where = "только фальшивый API" if args.workers > 1 else "бот и фальшивый API в одном процессе"
+    print(f"Пиковый RSS: {peak_rss:.1f} МБ ({where})")
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -1,34 +1,101 @@
 # bot.py — Telegram-бот: 20 вопросов с пояснениями
-# Запускается на Render.com с keep-alive через Flask
+# Запускается на Render.com: один ASGI-сервер на $PORT (health + webhook)
 
-import os
-import random
-import time
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
-
-# === Добавляем Flask для keep-alive (чтобы бот не засыпал на Render) ===
-from flask import Flask
-from threading import Thread
-
-app = Flask('')
-
-@app.route('/')
-def home():
-    return '<b>Бот работает!</b>'
+# Первым делом — отметка времени: дальше считаем фазы запуска (см. startup.py)
+import startup
 
-def run():
-    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
+startup.mark("interpreter")
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
+import asyncio
+import logging
+import os
+import signal
+import sqlite3
+import struct
+import time
+from collections import OrderedDict
+
+from telegram import Bot, Message, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
+from telegram.ext import (
+    Application,
+    ApplicationHandlerStop,
+    CallbackQueryHandler,
+    CommandHandler,
+    ContextTypes,
+    InlineQueryHandler,
+    TypeHandler,
+)
+
+from bank_loader import BankHolder, load_bank, load_python_bank
+from export import ExportError, Exporter, parse_filters, read_part
+from metrics import ERRORS, STALE_CALLBACKS, TIMEOUTS, instrument, registry
+from monitor import LoopMonitor
+from outbox import Outbox
+from question_bank import compile_bank, next_keyboard, render_question
+from quizzes import Quiz, QuizRegistry, load_quizzes
+from selection import MODE_REVIEW, MODE_UNSEEN, History, QuestionSelector
+from sessions import (
+    MemorySessionStore,
+    RedisSessionStore,
+    Session,
+    SharedSqliteSessionStore,
+    SqliteSessionStore,
+)
+from share import ShareCards, parse_quiz_id, parse_score, result_level, share_query
+from timers import TimingWheel
+from transport import build_requests
+from update_processor import PerUserUpdateProcessor
+
+# uvicorn, starlette и httpx маршрутизатора импортируются в serve()/serve_router():
+# в режиме polling бот начинает принимать обновления раньше, чем поднимется веб-сервер
+startup.mark("imports")
+
+logger = logging.getLogger(__name__)
+
+# === Режим запуска ===
+# BOT_MODE=polling (по умолчанию) или webhook. В обоих режимах на $PORT работает
+# один ASGI-сервер в том же event loop, что и бот, — без отдельного потока.
+# BOT_MODE=worker — процесс за маршрутизатором (см. cluster.py): принимает
+# пересланные обновления на $PORT, webhook у Telegram не регистрирует.
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+PORT = int(os.environ.get("PORT", 8080))
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL") or os.environ.get("RENDER_EXTERNAL_URL")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+ALLOWED_UPDATES = ["callback_query", "message", "inline_query"]
+BOT_API_BASE_URL = os.environ.get("BOT_API_BASE_URL")
+
+# === Несколько процессов ===
+# WORKERS>1 в режиме webhook: этот процесс только принимает обновления и
+# раскладывает их по воркерам по user_id. WORKER_URLS — уже запущенные воркеры
+# (например, на других машинах) вместо локальных процессов.
+WORKERS = int(os.environ.get("WORKERS", 1))
+WORKER_BASE_PORT = int(os.environ.get("WORKER_BASE_PORT", PORT + 1))
+WORKER_URLS = [url for url in os.environ.get("WORKER_URLS", "").split(",") if url]
+ROUTER = BOT_MODE == "webhook" and (WORKERS > 1 or bool(WORKER_URLS))
+
+# Сколько обновлений обрабатывать одновременно (разные пользователи — параллельно,
+# один пользователь — по очереди). 1 — строго последовательно, как раньше.
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", 64))
+
+# === Все исходящие сообщения идут через очередь с лимитами Telegram ===
+# Хендлеры только ставят запрос в очередь и не ждут ответа API
+OUTBOX_GLOBAL_RATE = float(os.environ.get("OUTBOX_GLOBAL_RATE", 30))
+outbox = Outbox(
+    global_rate=OUTBOX_GLOBAL_RATE,
+    chat_rate=float(os.environ.get("OUTBOX_CHAT_RATE", 1)),
+    chat_burst=int(os.environ.get("OUTBOX_CHAT_BURST", 3)),
+)
 
 
 # === Импортируем вопросы ===
-try:
-    from questions import questions
-except ImportError:
+# QUESTIONS_CACHE_DIR — куда складывать скомпилированный банк (см. bank_loader.py);
+# пустое значение отключает кэш
+QUESTIONS_CACHE_DIR = os.environ.get("QUESTIONS_CACHE_DIR", ".cache") or None
+QUESTIONS_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "questions.py")
+
+if not os.path.exists(QUESTIONS_PY):
     print("⚠️ Не найдён questions.py. Используем резервные вопросы.")
     questions = [
         {
@@ -51,273 +118,950 @@ except ImportError:
         }
     ]
 
+# Проверяем и компилируем вопросы один раз при загрузке.
+# QUESTIONS_FILE — внешний банк (JSON Lines или SQLite) с горячей перезагрузкой;
+# без него используется questions.py.
+QUESTIONS_FILE = os.environ.get("QUESTIONS_FILE")
+QUESTIONS_LAZY = os.environ.get("QUESTIONS_LAZY", "auto")
+QUESTIONS_RELOAD_INTERVAL = float(os.environ.get("QUESTIONS_RELOAD_INTERVAL", 5))
+QUIZ_LENGTH = 20
+
+# === Тесты (см. quizzes.py) ===
+# QUIZZES_FILE — список тестов (JSON), каждый со своим банком, длиной и уровнями;
+# без него один тест из QUESTIONS_FILE или questions.py
+QUIZZES_FILE = os.environ.get("QUIZZES_FILE")
+
+if QUIZZES_FILE:
+    quizzes = load_quizzes(QUIZZES_FILE, QUESTIONS_LAZY, QUESTIONS_CACHE_DIR)
+else:
+    if QUESTIONS_FILE:
+        banks = BankHolder(
+            load_bank(QUESTIONS_FILE, QUESTIONS_LAZY, QUESTIONS_CACHE_DIR),
+            path=QUESTIONS_FILE,
+            lazy=QUESTIONS_LAZY,
+            cache_dir=QUESTIONS_CACHE_DIR,
+        )
+    elif os.path.exists(QUESTIONS_PY):
+        banks = BankHolder(load_python_bank(QUESTIONS_PY, QUESTIONS_CACHE_DIR))
+    else:
+        banks = BankHolder(compile_bank(questions))
+    quizzes = QuizRegistry([Quiz("main", "Тренажёр переговоров", banks, length=QUIZ_LENGTH)])
+# Банк первого теста — для кода, которому тест не важен
+banks = quizzes.default.banks
+startup.mark("bank")
+
 
 # === Храним данные пользователей ===
-user_data = {}
+# SESSION_STORE=memory (по умолчанию) или sqlite — тогда сессии переживают перезапуск.
+# Для нескольких процессов: shared (общий SQLite на одной машине) или redis (REDIS_URL;
+# memory:// — замена Redis в памяти процесса, для тестов).
+SESSION_STORE = os.environ.get("SESSION_STORE", "memory")
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 6 * 3600))
+SESSION_MAX = int(os.environ.get("SESSION_MAX", 100000))
+
+# Старые версии банка нужны, пока живут начатые на них тесты
+for holder in quizzes.banks():
+    holder.retain = SESSION_TTL
+
+SESSION_DB = os.environ.get("SESSION_DB", "sessions.db")
+# История ответов (для выбора невиденных вопросов и работы над ошибками) живёт дольше сессий
+HISTORY_TTL = int(os.environ.get("HISTORY_TTL", 90 * 24 * 3600))
+
+if SESSION_STORE == "redis":
+    REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+    user_data = RedisSessionStore(REDIS_URL, ttl=SESSION_TTL)
+    history_store = RedisSessionStore(
+        REDIS_URL,
+        encode=History.to_bytes,
+        decode=History.from_bytes,
+        ttl=HISTORY_TTL,
+        prefix="history:",
+    )
+elif SESSION_STORE == "shared":
+    user_data = SharedSqliteSessionStore(SESSION_DB, ttl=SESSION_TTL)
+    history_store = SharedSqliteSessionStore(
+        SESSION_DB,
+        encode=History.to_bytes,
+        decode=History.from_bytes,
+        ttl=HISTORY_TTL,
+        table="shared_history",
+    )
+elif SESSION_STORE == "sqlite":
+    user_data = SqliteSessionStore(SESSION_DB, ttl=SESSION_TTL, cache_size=SESSION_MAX)
+    history_store = SqliteSessionStore(
+        SESSION_DB,
+        encode=History.to_bytes,
+        decode=History.from_bytes,
+        ttl=HISTORY_TTL,
+        cache_size=SESSION_MAX,
+        table="history",
+    )
+else:
+    user_data = MemorySessionStore(max_size=SESSION_MAX, ttl=SESSION_TTL)
+    history_store = MemorySessionStore(max_size=SESSION_MAX, ttl=HISTORY_TTL)
+
+# === Перезапуск без потери тестов ===
+# По SIGTERM бот перестаёт принимать обновления, дожидается начатых хендлеров и
+# отправки очереди (не дольше SHUTDOWN_TIMEOUT секунд), а сессии из памяти
+# сохраняет в SESSION_SNAPSHOT; при запуске снимок читается до первого обновления.
+# Хранилища sqlite/shared/redis переживают перезапуск сами.
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", 20))
+SESSION_SNAPSHOT = os.environ.get("SESSION_SNAPSHOT", "sessions.snapshot")
+
+selector = QuestionSelector(history_store)
+startup.mark("stores")
+
+# === Журнал ответов и статистика по вопросам (см. events.py) ===
+# Каждый воркер пишет свой файл в общий каталог
+EVENTS_DIR = os.environ.get("EVENTS_DIR", "events")
+WORKER_INDEX = os.environ.get("WORKER_INDEX")
+
+# === Рейтинг (см. leaderboard.py); файл общий для всех воркеров ===
+LEADERBOARD_DB = os.environ.get("LEADERBOARD_DB", "leaderboard.db")
+
+# Журнал и рейтинг у каждого теста свои; events и leaderboard — первого теста
+quizzes.open(EVENTS_DIR, f"events-{WORKER_INDEX}" if WORKER_INDEX else "events", LEADERBOARD_DB)
+events = quizzes.default.events
+leaderboard = quizzes.default.leaderboard
+
+# === Выгрузка для администраторов (см. export.py) ===
+# ADMIN_IDS — user_id через запятую, кому доступна /export. ADMIN_TOKEN включает
+# GET /export и /debug/profile на веб-сервере (см. web.py). Большая выгрузка уходит в Telegram частями
+# по EXPORT_PART_BYTES (лимит Bot API на документ — 50 МБ).
+ADMIN_IDS = {int(user_id) for user_id in os.environ.get("ADMIN_IDS", "").split(",") if user_id.strip()}
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+EXPORT_PART_BYTES = int(os.environ.get("EXPORT_PART_BYTES", 8 * 1024 * 1024))
+exporter = Exporter(quizzes)
+
+# Режим обработки ответа:
+#   single  — одно редактирование сообщения (текст + кнопки), query.answer() уходит параллельно
+#   classic — сначала снимаем кнопки, потом отдельно редактируем текст
+ANSWER_MODE = os.environ.get("ANSWER_MODE", "single")
+SINGLE_EDIT = ANSWER_MODE != "classic"
+
+# === Таймеры (см. timers.py) ===
+# SESSION_IDLE_TIMEOUT — через сколько секунд без действий брошенный тест удаляется.
+# QUESTION_TIME_LIMIT — секунд на вопрос (0 — без ограничения): по истечении ответ
+# засчитывается как неверный и бот сам переходит к следующему вопросу.
+SESSION_IDLE_TIMEOUT = float(os.environ.get("SESSION_IDLE_TIMEOUT", SESSION_TTL))
+QUESTION_TIME_LIMIT = float(os.environ.get("QUESTION_TIME_LIMIT", 0))
+timers = TimingWheel()
+
+# === Здоровье event loop (см. monitor.py) ===
+# LOOP_SLOW_THRESHOLD — с какой блокировки loop (сек) записывать виновную функцию
+loop_monitor = LoopMonitor(slow_threshold=float(os.environ.get("LOOP_SLOW_THRESHOLD", 0.25)))
+
+
+def touch_session(user_id):
+    # Любое действие в тесте откладывает удаление сессии
+    timers.schedule(("idle", user_id), SESSION_IDLE_TIMEOUT)
+
+
+# === Устаревшие и повторные нажатия ===
+# callback_data кнопок теста несут метку вопроса: ans_<i>_<nonce>_<номер>,
+# next_<nonce>_<номер>, restart_<nonce>_<тест>. Нажатие, чья метка не совпадает с
+# сессией, получает только query.answer() — без записи сессии и запросов к API.
+# Клавиатуры без метки (отправлены до обновления бота) принимаются как раньше.
+def is_tagged(query):
+    return len(query.data.split("_")) >= 3
+
+
+def is_stale(query, data: Session):
+    if not is_tagged(query):
+        return False
+    parts = query.data.split("_")
+    return parts[-2] != str(data.nonce) or parts[-1] != str(data.index)
+
+
+async def not_started(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Сессии нет: тест закончен, удалён по простою или потерян при перезапуске.
+    # Помеченной кнопке хватает подсказки в ответе на нажатие — без лишних запросов
+    # к API и не трогая сообщение; клавиатура без метки получает её, как раньше,
+    # вместо вопроса
+    query = update.callback_query
+    if is_tagged(query):
+        STALE_CALLBACKS.inc("no_session")
+        await answer_query(update, context, "Тест не начат. Напишите /start")
+        return
+    await answer_query(update, context)
+    outbox.edit_message_text(
+        query.message.chat_id,
+        query.message.message_id,
+        "Тест не начат. Напишите /start",
+        fallback_to_send=True
+    )
+
+
+# Telegram может повторить доставку обновления (например, webhook не ответил вовремя) —
+# один и тот же callback_query.id обрабатываем один раз
+CALLBACK_CACHE_SIZE = 10000
+seen_callbacks = OrderedDict()
+
+
+async def drop_duplicate_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query_id = update.callback_query.id
+    if query_id in seen_callbacks:
+        # На этот запрос уже ответили — повторный answer() Telegram отклонит
+        STALE_CALLBACKS.inc("duplicate")
+        raise ApplicationHandlerStop
+    seen_callbacks[query_id] = None
+    if len(seen_callbacks) > CALLBACK_CACHE_SIZE:
+        seen_callbacks.popitem(last=False)
+
+
+# === Ответ на нажатие кнопки ===
+async def answer_query(update: Update, context: ContextTypes.DEFAULT_TYPE, text=None):
+    if SINGLE_EDIT:
+        # Не ждём ответа Telegram — запрос идёт параллельно с редактированием
+        context.application.create_task(update.callback_query.answer(text), update=update)
+    else:
+        await update.callback_query.answer(text)
+
+
+# === Выбор теста ===
+# /start <id> (ссылка t.me/<бот>?start=<id>) или /review <id>; кнопки итогов
+# несут номер теста: restart_<nonce>_<тест>. None — такого теста нет.
+def requested_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.callback_query:
+        parts = update.callback_query.data.split("_")
+        if len(parts) > 2 and parts[2].isdigit():
+            return quizzes.by_number(int(parts[2]))
+        return quizzes.default
+    if context.args:
+        return quizzes.get(context.args[0])
+    return quizzes.default
+
+
+def quiz_list():
+    return "\n".join(f"/start {quiz.id} — {quiz.title}" for quiz in quizzes)
 
 
 # === Обработчик /start ===
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@instrument("start")
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE, mode: str = MODE_UNSEEN):
     user_id = update.effective_user.id
+    quiz = requested_quiz(update, context)
+    if quiz is None:
+        outbox.send_message(update.effective_chat.id, f"Такого теста нет. Доступные тесты:\n{quiz_list()}")
+        return
 
     # Очищаем старые данные
-    if user_id in user_data:
-        del user_data[user_id]
+    user_data.delete(user_id)
 
-    # Выбираем 20 случайных вопросов
-    selected_questions = random.sample(questions, min(20, len(questions)))
+    # Выбираем вопросы: сначала невиденные (или с ошибками в режиме review),
+    # храним только их номера в банке теста
+    bank = quiz.banks.current
+    selected = selector.select(quiz.history_key(user_id), len(bank), quiz.length, mode)
 
     # Сохраняем состояние
-    user_data[user_id] = {
-        "questions": selected_questions,
-        "index": 0,
-        "correct_count": 0,
-        "start_time": time.time(),
-        "answered": False
-    }
+    data = Session.new(selected, len(bank), time.time(), bank_version=quiz.banks.version, quiz=quiz.number)
+    user_data.put(user_id, data)
+    touch_session(user_id)
 
     # Отправляем приветствие, только если это /start (а не перезапуск)
     if update.message:
-        await update.message.reply_text(
-            f"🎯 Начинаем тест из {len(selected_questions)} вопросов!\n"
-            "Отвечайте честно — и получите полезные пояснения."
-        )
+        if mode == MODE_REVIEW:
+            greeting = (
+                f"🧠 Работа над ошибками: {data.total} вопросов!\n"
+                "Сначала — те, где вы ошибались раньше."
+            )
+        else:
+            greeting = f"🎯 Начинаем тест из {data.total} вопросов!\n{quiz.intro}"
+        if len(quizzes) > 1:
+            greeting = f"📚 {quiz.title}\n{greeting}"
+        if QUESTION_TIME_LIMIT:
+            greeting += f"\n⏳ На каждый вопрос — {QUESTION_TIME_LIMIT:g} сек."
+        outbox.send_message(update.effective_chat.id, greeting)
 
     # Задаём первый вопрос
-    await send_next_question(update, context, user_id)
+    await send_next_question(update, context, data)
 
 
 # === Отправка следующего вопроса ===
-async def send_next_question(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
-    data = user_data[user_id]
-    if data["index"] >= len(data["questions"]):
-        await show_results(update, context, user_id)
-        return
+# Сессию уже сохранил вызывающий хендлер — здесь только показываем вопрос
+async def send_next_question(update: Update, context: ContextTypes.DEFAULT_TYPE, data: Session):
+    if data.index == 0 and update.message:
+        message_id = None
+    else:
+        message_id = update.callback_query.message.message_id
+    show_question(update.effective_chat.id, message_id, update.effective_user, data)
 
-    data["answered"] = False
-    q = data["questions"][data["index"]]
 
-    message_text = f"📝 Вопрос {data['index'] + 1} из {len(data['questions'])}:\n\n"
-    message_text += f"{q['question']}\n\n"
-    for i, option in enumerate(q["options"], start=1):
-        message_text += f"{i}. {option}\n"
-    message_text += "\n🔢 Выберите номер ответа:"
+def show_question(chat_id, message_id, user, data: Session, prefix=""):
+    # message_id=None — новым сообщением, иначе редактируем
+    q = quizzes.of(data).banks.get(data.bank_version)[data.question_id]
 
-    buttons = []
-    row = []
-    for i in range(1, len(q["options"]) + 1):
-        row.append(InlineKeyboardButton(str(i), callback_data=f"ans_{i-1}"))
-        if len(row) == 4 or i == len(q["options"]):
-            buttons.append(row)
-            row = []
-    reply_markup = InlineKeyboardMarkup(buttons)
+    message_text = prefix + render_question(q, data.index + 1, data.total)
+    reply_markup = q.keyboard(data.tag)
 
-    try:
-        if data["index"] == 0 and update.message:
-            await update.message.reply_text(message_text, reply_markup=reply_markup)
-        else:
-            await context.bot.edit_message_text(
-                chat_id=update.effective_chat.id,
-                message_id=update.callback_query.message.message_id,
-                text=message_text,
-                reply_markup=reply_markup
-            )
-    except:
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=message_text,
-            reply_markup=reply_markup
+    if message_id is None:
+        sent = outbox.send_message(chat_id, message_text, reply_markup=reply_markup, required=True)
+    else:
+        sent = outbox.edit_message_text(
+            chat_id,
+            message_id,
+            message_text,
+            reply_markup=reply_markup,
+            fallback_to_send=True,
+            required=True
         )
+    if QUESTION_TIME_LIMIT:
+        timers.schedule(("question", user.id), QUESTION_TIME_LIMIT, (chat_id, message_id, sent, data.index, user))
 
 
 # === Обработчик ответа ===
+@instrument("button_click")
 async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
-
     user_id = query.from_user.id
 
-    if user_id not in user_data:
-        try:
-            await query.edit_message_text("Тест не начат. Напишите /start")
-        except:
-            await query.message.reply_text("Тест не начат. Напишите /start")
+    data = user_data.get(user_id)
+    if data is None:
+        await not_started(update, context)
         return
 
-    data = user_data[user_id]
-    if data["index"] >= len(data["questions"]) or data["answered"]:
+    await answer_query(update, context)
+    if is_stale(query, data):
+        STALE_CALLBACKS.inc("stale")
+        return
+
+    if data.finished:
         await show_results(update, context, user_id)
         return
 
-    # Убираем кнопки сразу после нажатия
-    try:
-        await context.bot.edit_message_reply_markup(
-            chat_id=update.effective_chat.id,
-            message_id=query.message.message_id,
-            reply_markup=None
-        )
-    except:
-        pass
+    # Повторное нажатие на уже отвеченный вопрос — игнорируем
+    if data.answered:
+        return
+
+    if not SINGLE_EDIT:
+        # Убираем кнопки сразу после нажатия
+        try:
+            await context.bot.edit_message_reply_markup(
+                chat_id=update.effective_chat.id,
+                message_id=query.message.message_id,
+                reply_markup=None
+            )
+        except TelegramError as e:
+            ERRORS.inc("edit_reply_markup", type(e).__name__)
 
     try:
         chosen_index = int(query.data.split("_")[1])
     except (IndexError, ValueError):
-        await query.message.reply_text("❌ Ошибка при обработке ответа.")
+        outbox.send_message(query.message.chat_id, "❌ Ошибка при обработке ответа.")
         return
 
-    q = data["questions"][data["index"]]
-    correct_index = q["correct"]
-
-    if chosen_index == correct_index:
-        data["correct_count"] += 1
-        data["answered"] = True
-        data["index"] += 1
+    question_id = data.question_id
+    quiz = quizzes.of(data)
+    q = quiz.banks.get(data.bank_version)[question_id]
+    correct_index = q.correct
+    is_correct = chosen_index == correct_index
+    now = time.time()
+    seconds = now - data.shown_at
+
+    if is_correct:
+        # Сразу переходим к следующему вопросу — одна запись сессии
+        data.correct_count += 1
+        data.index += 1
+        data.shown_at = now
+    else:
+        data.answered = True
+    # Атомарный переход: если сессию уже изменило другое нажатие
+    # (в том числе в другом процессе), это нажатие устарело
+    if not user_data.compare_and_set(user_id, data):
+        return
+    timers.cancel(("question", user_id))
+    touch_session(user_id)
+    retry = selector.record(quiz.history_key(user_id), question_id, is_correct)
+    quiz.events.answer(user_id, question_id, data.bank_version, chosen_index, is_correct, seconds, retry)
 
-        if data["index"] >= len(data["questions"]):
+    if is_correct:
+        if data.finished:
             await show_results(update, context, user_id)
             return
 
-        await send_next_question(update, context, user_id)
+        await send_next_question(update, context, data)
     else:
-        data["answered"] = True
-        correct_option = q["options"][correct_index]
-        explanation = q["explanation"]
-
-        feedback_text = (
-            f"❌ Неправильно.\n\n"
-            f"📌 *Вопрос:* {q['question']}\n\n"
-            f"✅ *Правильный ответ:* {correct_index + 1}. {correct_option}\n\n"
-            f"📘 *Пояснение:*\n{explanation}"
+        # Текст пояснения собран и экранирован при загрузке банка (см. question_bank.py)
+        outbox.edit_message_text(
+            update.effective_chat.id,
+            query.message.message_id,
+            q.feedback,
+            reply_markup=next_keyboard(data.tag),
+            parse_mode="HTML",
+            fallback_to_send=True,
+            required=True
         )
 
-        keyboard = [[InlineKeyboardButton("➡️ Следующий вопрос", callback_data="next")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        try:
-            await context.bot.edit_message_text(
-                chat_id=update.effective_chat.id,
-                message_id=query.message.message_id,
-                text=feedback_text,
-                reply_markup=reply_markup,
-                parse_mode="Markdown"
-            )
-        except:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=feedback_text,
-                reply_markup=reply_markup,
-                parse_mode="Markdown"
-            )
-
 
 # === Кнопка "Следующий вопрос" после ошибки ===
+@instrument("next_question")
 async def next_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
-
     user_id = query.from_user.id
-    if user_id not in user_data:
-        await query.edit_message_text("Тест не начат. Напишите /start")
+    data = user_data.get(user_id)
+    if data is None:
+        await not_started(update, context)
+        return
+
+    await answer_query(update, context)
+    if is_stale(query, data):
+        STALE_CALLBACKS.inc("stale")
         return
 
-    data = user_data[user_id]
-    data["index"] += 1
-    data["answered"] = False
+    # "Дальше" имеет смысл только после ошибки в текущем вопросе
+    if not data.answered:
+        STALE_CALLBACKS.inc("stale")
+        return
 
-    if data["index"] >= len(data["questions"]):
+    data.index += 1
+    data.answered = False
+    data.shown_at = time.time()
+    if not user_data.compare_and_set(user_id, data):
+        return
+    touch_session(user_id)
+
+    if data.finished:
         await show_results(update, context, user_id)
         return
 
-    await send_next_question(update, context, user_id)
+    await send_next_question(update, context, data)
 
 
 # === Обработчик "Пройти заново" ===
+@instrument("restart_test")
 async def restart_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
+    await answer_query(update, context)
+    if is_repeated_restart(update):
+        return
     await start(update, context)  # передаём update — start сам разберётся
 
 
+def is_repeated_restart(update: Update):
+    # Кнопки итогов несут nonce законченного теста, а его сессия уже удалена.
+    # Если сессия есть — тест начат заново этой же кнопкой (двойное нажатие)
+    # или другим способом, и старые итоги его не сбрасывают
+    if "_" not in update.callback_query.data or user_data.get(update.effective_user.id) is None:
+        return False
+    STALE_CALLBACKS.inc("stale")
+    return True
+
+
+# === /review и кнопка "Работа над ошибками" ===
+@instrument("review")
+async def review(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.callback_query:
+        await answer_query(update, context)
+        if is_repeated_restart(update):
+            return
+    await start(update, context, mode=MODE_REVIEW)
+
+
 # === Показ итогов ===
+@instrument("show_results")
 async def show_results(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
-    if user_id not in user_data:
+    data = user_data.get(user_id)
+    if data is None:
         return
-
-    data = user_data[user_id]
-    correct = data["correct_count"]
-    total = len(data["questions"])
-    elapsed = int(time.time() - data["start_time"])
+    # После нажатия итоги заменяют сообщение с последним вопросом — вместе с его кнопками
+    message_id = update.callback_query.message.message_id if update.callback_query else None
+    send_results(update.effective_chat.id, update.effective_user, data, message_id=message_id)
+
+
+def send_results(chat_id, user, data: Session, prefix="", message_id=None):
+    # message_id=None — новым сообщением, иначе редактируем
+    user_id = user.id
+    quiz = quizzes.of(data)
+    leaderboard = quiz.leaderboard
+    correct = data.correct_count
+    total = data.total
+    elapsed_exact = time.time() - data.start_time
+    elapsed = int(elapsed_exact)
     minutes = elapsed // 60
     seconds = elapsed % 60
 
-    # Оценка уровня
-    if correct >= total * 0.9:
-        level = "🏅 Профессионал! Вы отлично чувствуете клиента."
-    elif correct >= total * 0.7:
-        level = "📈 Хороший уровень. Есть над чем поработать."
-    else:
-        level = "🌱 Начинающий. Повторите ключевые принципы коммуникации."
+    leaderboard.add(user_id, user.first_name, correct, total, elapsed_exact)
+
+    # Оценка уровня по порогам теста
+    level = result_level(correct, total, quiz.levels)
 
     result_text = (
-        f"🎉 Тест завершён!\n\n"
+        f"{prefix}🎉 Тест завершён!\n\n"
         f"✅ Правильных: {correct} из {total}\n"
-        f"⏱ Время: {minutes} мин {seconds} сек\n\n"
+        f"⏱ Время: {minutes} мин {seconds} сек\n"
+        f"🏆 Место в рейтинге: {leaderboard.rank(user_id)} из {len(leaderboard)}\n\n"
         f"{level}"
     )
 
     # Кнопки: Пройти заново + Поделиться
     keyboard = [
-        [InlineKeyboardButton("🔁 Пройти заново", callback_data="restart")],
-        [InlineKeyboardButton("📤 Поделиться результатом", switch_inline_query=f"Я набрал {correct}/{total} в тренажёре переговоров!")]
+        [InlineKeyboardButton("🔁 Пройти заново", callback_data=f"restart_{data.nonce}_{quiz.number}")],
+    ]
+    if selector.history(quiz.history_key(user_id)).wrong_ids:
+        keyboard.append([InlineKeyboardButton(
+            "🧠 Работа над ошибками", callback_data=f"review_{data.nonce}_{quiz.number}")])
+    keyboard += [
+        [InlineKeyboardButton("📤 Поделиться результатом", switch_inline_query=share_query(quiz, correct, total))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    try:
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=result_text,
-            reply_markup=reply_markup,
-            parse_mode=None
-        )
-    except:
-        pass
+    # Итоги — последнее сообщение теста: сессия уже удалена, повторить их будет некому
+    if message_id is None:
+        outbox.send_message(chat_id, result_text, reply_markup=reply_markup, required=True)
+    else:
+        outbox.edit_message_text(chat_id, message_id, result_text, reply_markup=reply_markup,
+                                 fallback_to_send=True, required=True)
+
+    quiz.events.completed(user_id, data.bank_version, correct, total, elapsed_exact)
 
     # Удаляем данные
-    if user_id in user_data:
-        del user_data[user_id]
+    user_data.delete(user_id)
+    timers.cancel(("idle", user_id))
+    timers.cancel(("question", user_id))
 
 
-# === Запуск бота ===
-if __name__ == "__main__":
-    token = os.getenv("BOT_TOKEN")
-    if not token:
-        print("❌ ОШИБКА: Не задан BOT_TOKEN в переменных окружения!")
-        exit(1)
+# === Сработавшие таймеры ===
+def on_timer(application: Application, key, payload):
+    kind, user_id = key
+    TIMEOUTS.inc(kind)
+    if kind == "idle":
+        handler = expire_session(user_id)
+    else:
+        handler = question_timeout(user_id, *payload)
+    # Через update_processor — по очереди с обновлениями этого же пользователя
+    application.create_task(application.update_processor.process_update(user_id, handler))
+
+
+async def expire_session(user_id):
+    # Брошенный тест: молча удаляем, пользователь может начать заново через /start
+    user_data.delete(user_id)
+    timers.cancel(("question", user_id))
 
-    # Запускаем веб-сервер для keep-alive (чтобы Render не "спал")
-    keep_alive()
 
-    # Создаём приложение
-    application = Application.builder().token(token).build()
+@instrument("question_timeout")
+async def question_timeout(user_id, chat_id, message_id, sent, index, user):
+    data = user_data.get(user_id)
+    # Пользователь успел ответить (или тест уже другой) — таймер устарел
+    if data is None or data.finished or data.index != index or data.answered:
+        return
+
+    question_id = data.question_id
+    now = time.time()
+    seconds = now - data.shown_at
+    data.index += 1
+    data.shown_at = now
+    if not user_data.compare_and_set(user_id, data):
+        return
+    touch_session(user_id)
+    quiz = quizzes.of(data)
+    retry = selector.record(quiz.history_key(user_id), question_id, False)
+    quiz.events.answer(user_id, question_id, data.bank_version, None, False, seconds, retry)
+
+    # Вопрос мог уйти новым сообщением — его id знает только результат отправки
+    result = sent.result() if sent.done() else None
+    if isinstance(result, Message):
+        message_id = result.message_id
+
+    prefix = f"⏰ Время на вопрос {index + 1} вышло.\n\n"
+    if data.finished:
+        send_results(chat_id, user, data, prefix, message_id)
+        return
+    show_question(chat_id, message_id, user, data, prefix)
+
+
+# === /top [id] — лучшие результаты теста ===
+@instrument("top")
+async def top(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    quiz = requested_quiz(update, context)
+    if quiz is None:
+        outbox.send_message(update.effective_chat.id, f"Такого теста нет. Доступные тесты:\n{quiz_list()}")
+        return
+    leaderboard = quiz.leaderboard
+    rows = leaderboard.top(10)
+    if not rows:
+        command = "/start" if quiz.number == 0 else f"/start {quiz.id}"
+        outbox.send_message(update.effective_chat.id, f"🏆 Пока никто не прошёл тест — будьте первым! {command}")
+        return
+    lines = [f"🏆 Лучшие результаты — {quiz.title}:\n" if len(quizzes) > 1 else "🏆 Лучшие результаты:\n"]
+    for place, (_, name, correct, total, elapsed) in enumerate(rows, start=1):
+        elapsed = int(elapsed)
+        lines.append(f"{place}. {name} — {correct}/{total}, {elapsed // 60} мин {elapsed % 60} сек")
+    rank = leaderboard.rank(update.effective_user.id)
+    if rank is not None:
+        lines.append(f"\nВаше место: {rank} из {len(leaderboard)}")
+    outbox.send_message(update.effective_chat.id, "\n".join(lines))
+
+
+# === /export — выгрузка результатов (только ADMIN_IDS) ===
+EXPORT_USAGE = (
+    "Использование: /export [results|leaderboard|questions] [csv|jsonl] "
+    "[quiz=ID] [since=YYYY-MM-DD] [until=YYYY-MM-DD] [min_score=N] [max_score=N]"
+)
+
+
+@instrument("export")
+async def export_results(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    chat_id = update.effective_chat.id
+    args = context.args or []
+    positional = [arg for arg in args if "=" not in arg]
+    params = dict(arg.split("=", 1) for arg in args if "=" in arg)
+    kind = positional[0] if positional else "results"
+    fmt = positional[1] if len(positional) > 1 else "csv"
+    quiz_id = params.pop("quiz", None)
+    try:
+        exporter.check(kind, fmt, quiz_id)
+        filters = parse_filters(params)
+    except ExportError as e:
+        outbox.send_message(chat_id, f"❌ {e}\n\n{EXPORT_USAGE}")
+        return
+    outbox.send_message(chat_id, "⏳ Готовлю выгрузку...")
+    # Отдельной задачей: длинная выгрузка не держит очередь обновлений администратора
+    context.application.create_task(send_export(chat_id, kind, fmt, quiz_id, filters), update=update)
+
+
+async def send_export(chat_id, kind, fmt, quiz_id, filters):
+    chunks = exporter.stream(kind, fmt, quiz_id, **filters)
+    filename = exporter.filename(kind, fmt, quiz_id)
+    parts = 0
+    try:
+        while True:
+            # Чтение и форматирование — в потоке; в памяти не больше одной части
+            part = await asyncio.to_thread(read_part, chunks, EXPORT_PART_BYTES)
+            if not part:
+                break
+            parts += 1
+            name = filename
+            if parts > 1 or len(part) >= EXPORT_PART_BYTES:
+                name = filename.replace(f".{fmt}", f".part{parts}.{fmt}")
+            if await outbox.send_document(chat_id, part, name) is None:
+                outbox.send_message(chat_id, f"❌ Не удалось отправить часть {parts}")
+                return
+    except (OSError, sqlite3.Error) as e:
+        ERRORS.inc("export", type(e).__name__)
+        logger.error("Выгрузка %s не удалась: %s", kind, e)
+        outbox.send_message(chat_id, "❌ Выгрузка не удалась, подробности в логе")
+        return
+    finally:
+        chunks.close()
+    if not parts:
+        outbox.send_message(chat_id, "Нет данных за выбранный период.")
+
+
+# === Инлайн-режим: карточка «Поделиться результатом» (см. share.py) ===
+# INLINE_CACHE_TIME — сколько секунд Telegram отдаёт ответ из своего кэша
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", 300))
+share_cards = ShareCards()
+
+
+@instrument("inline_share")
+async def inline_share(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    username = context.bot.username
+    # Тест — по #id из текста кнопки «Поделиться»
+    quiz = quizzes.get(parse_quiz_id(query.query)) or quizzes.default
+    leaderboard = quiz.leaderboard
+    results = []
+    score = parse_score(query.query)
+    if score is not None:
+        results.append(share_cards.score(username, quiz, *score))
+    best = leaderboard.best(query.from_user.id)
+    if best is not None:
+        correct, total, _ = best
+        results.append(share_cards.best(username, quiz, correct, total, leaderboard.rank(query.from_user.id)))
+    if not results:
+        results.append(share_cards.invite(username, quiz))
+    # Место в рейтинге у каждого своё — тогда и кэш Telegram личный
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=best is not None)
+
+
+# === Ошибки, вылетевшие из хендлеров и фоновых задач ===
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+    ERRORS.inc("handler", type(context.error).__name__)
+    logger.error("Ошибка при обработке обновления", exc_info=context.error)
+
+
+# === Время до первого обработанного обновления — его и ждёт пользователь после пробуждения ===
+async def mark_first_update(update: object, context: ContextTypes.DEFAULT_TYPE):
+    if "first_update" not in startup.phases:
+        startup.mark("first_update")
+        print(f"⏱ Запуск: {startup.report()}")
+
+
+# === Метрики состояния, которые считаются при выгрузке /metrics ===
+def register_gauges(application: Application):
+    registry.gauge("bot_sessions", "Сессий в хранилище", lambda: len(user_data))
+    registry.gauge("bot_timers", "Запущенных таймеров (сессии и время на вопрос)", lambda: len(timers))
+    registry.gauge(
+        "bot_event_loop", "Максимальное опоздание loop (сек) и число блокировок",
+        lambda: {(k,): v for k, v in loop_monitor.stats().items()}, ["stat"])
+    registry.gauge(
+        "bot_leaderboard_size", "Пользователей в рейтинге теста",
+        lambda: {(quiz.id,): len(quiz.leaderboard) for quiz in quizzes}, ["quiz"])
+    registry.gauge(
+        "bot_share_cards", "Кэш карточек инлайн-режима",
+        lambda: {(k,): v for k, v in share_cards.stats().items()}, ["stat"])
+    registry.gauge(
+        "bot_startup_seconds", "Фазы запуска: секунд от старта процесса",
+        lambda: {(phase,): seconds for phase, seconds in startup.phases.items()}, ["phase"])
+    registry.gauge(
+        "bot_question_bank_version", "Текущая версия банка вопросов теста",
+        lambda: {(quiz.id,): quiz.banks.version for quiz in quizzes}, ["quiz"])
+    registry.gauge(
+        "bot_question_bank_size", "Вопросов в текущем банке теста",
+        lambda: {(quiz.id,): len(quiz.banks.current) for quiz in quizzes}, ["quiz"])
+    registry.gauge("bot_sessions_active", "Сессий с активностью за 5 минут", lambda: user_data.active(300))
+    registry.gauge(
+        "bot_updates_in_progress", "Обновлений в обработке",
+        lambda: application.update_processor.current_concurrent_updates)
+    registry.gauge(
+        "bot_outbox", "Очередь исходящих запросов и её счётчики",
+        lambda: {(k,): v for k, v in outbox.stats().items()}, ["stat"])
+    registry.gauge(
+        "bot_events", "Журнал событий теста: в очереди, записано, потеряно, ротаций",
+        lambda: {(quiz.id, k): v for quiz in quizzes for k, v in quiz.events.stats_summary().items()},
+        ["quiz", "stat"])
+    request = application.bot.request
+    if hasattr(request, "stats"):
+        registry.gauge(
+            "bot_api_pool", "Пул соединений к Bot API",
+            lambda: {(k,): v for k, v in request.stats().items() if k != "http_version"}, ["stat"])
+
+
+# === Сборка приложения ===
+def build_application(token, request=None, get_updates_request=None,
+                      max_concurrent_updates=MAX_CONCURRENT_UPDATES, base_url=None):
+    builder = Application.builder().token(token)
+    if base_url is not None:
+        # Например, локальный Bot API из bench/
+        builder = builder.base_url(base_url)
+    if max_concurrent_updates > 1:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(max_concurrent_updates))
+    if request is not None:
+        builder = builder.request(request)
+    if get_updates_request is not None:
+        builder = builder.get_updates_request(get_updates_request)
+    application = builder.build()
+    outbox.bot = application.bot
 
     # Добавляем хендлеры
+    application.add_handler(CallbackQueryHandler(drop_duplicate_callback), group=-2)
+    application.add_handler(TypeHandler(Update, mark_first_update), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CallbackQueryHandler(button_click, pattern="^ans_"))
-    application.add_handler(CallbackQueryHandler(next_question, pattern="^next$"))
-    application.add_handler(CallbackQueryHandler(restart_test, pattern="^restart$"))
+    application.add_handler(CallbackQueryHandler(next_question, pattern="^next(_|$)"))
+    application.add_handler(CallbackQueryHandler(restart_test, pattern="^restart(_|$)"))
+    application.add_handler(CommandHandler("review", review))
+    application.add_handler(CallbackQueryHandler(review, pattern="^review(_|$)"))
+    application.add_handler(CommandHandler("top", top))
+    application.add_handler(CommandHandler("export", export_results))
+    application.add_handler(InlineQueryHandler(inline_share))
+    application.add_error_handler(on_error)
+    register_gauges(application)
+    startup.mark("application")
+    return application
+
+
+# === Снимок сессий ===
+# Хранилища в памяти — тесты и история; пустой SESSION_SNAPSHOT отключает снимок
+def snapshot_stores():
+    if not SESSION_SNAPSHOT or not isinstance(user_data, MemorySessionStore):
+        return []
+    return [
+        (user_data, SESSION_SNAPSHOT, Session.to_bytes, Session.from_bytes),
+        (history_store, SESSION_SNAPSHOT + ".history", History.to_bytes, History.from_bytes),
+    ]
 
-    print("✅ Бот запущен... Ждём /start")
 
-    # Запускаем polling
+def restore_sessions():
+    # True — тесты из снимка восстановлены
+    sessions_restored = False
+    for store, path, _, decode in snapshot_stores():
+        try:
+            restored = store.load_snapshot(path, decode)
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError, struct.error) as e:
+            ERRORS.inc("snapshot", type(e).__name__)
+            logger.error("Снимок %s не прочитан: %s", path, e)
+            continue
+        # Снимок одноразовый: после сбоя без сохранения не вернём устаревшие тесты
+        os.remove(path)
+        if store is user_data:
+            # Таймер времени на вопрос не восстанавливаем: сообщение с вопросом
+            # известно только хендлеру, который его отправил
+            for user_id in restored:
+                touch_session(user_id)
+            sessions_restored = True
+        print(f"♻️ Восстановлено из {path}: {len(restored)}")
+    return sessions_restored
+
+
+def save_sessions():
+    for store, path, encode, _ in snapshot_stores():
+        try:
+            saved = store.save_snapshot(path, encode)
+        except OSError as e:
+            ERRORS.inc("snapshot", type(e).__name__)
+            logger.error("Снимок %s не записан: %s", path, e)
+            continue
+        print(f"💾 Сохранено в {path}: {saved}")
+
+
+async def drain(application: Application):
+    # Перестаём принимать обновления, дожидаемся начатых и очереди отправки
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    if application.updater.running:
+        await application.updater.stop()
     try:
-        application.run_polling(
-            allowed_updates=["callback_query", "message"],
-            drop_pending_updates=True
+        # stop() обрабатывает уже полученные обновления и задачи create_task
+        await asyncio.wait_for(application.stop(), max(0.0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        logger.warning("Не дождались обработки обновлений за %g с", SHUTDOWN_TIMEOUT)
+    await outbox.stop(timeout=max(0.0, deadline - time.monotonic()))
+
+
+# === Основной цикл: бот + веб-сервер в одном event loop ===
+def warm_up():
+    # Рейтинг и статистику вопросов читаем с диска не в момент первого
+    # обращения из хендлера, а в фоне сразу после запуска
+    for quiz in quizzes:
+        quiz.leaderboard.load()
+        quiz.events.stats  # свойство: читает снимок при первом обращении
+
+
+async def serve(application: Application):
+    # До первого обновления: иначе нажатие кнопки успеет получить «Тест не начат»
+    restored = restore_sessions()
+    # Нажатия, сделанные во время перезапуска, обрабатываем, если тесты пережили его
+    # (снимок или постоянное хранилище); иначе ответить на них уже нечем
+    drop_pending = not restored and SESSION_STORE == "memory"
+    async with application:
+        if BOT_MODE == "webhook":
+            await set_webhook(application.bot, drop_pending)
+        elif BOT_MODE == "polling":
+            await application.updater.start_polling(
+                allowed_updates=ALLOWED_UPDATES,
+                drop_pending_updates=drop_pending
+            )
+        await application.start()
+
+        # Веб-сервер поднимаем после бота: в режиме polling обновления уже идут
+        from web import WebServer, create_web_app
+
+        webhook = BOT_MODE in ("webhook", "worker")
+        web_app = create_web_app(
+            application,
+            webhook_path=WEBHOOK_PATH if webhook else None,
+            secret_token=WEBHOOK_SECRET,
+            exporter=exporter,
+            admin_token=ADMIN_TOKEN,
         )
-    except KeyboardInterrupt:
-        print("\nБот остановлен.")
+        server = WebServer.for_app(web_app, PORT)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, server.handle_exit, sig, None)
+        startup.mark("ready")
+        warm = asyncio.create_task(asyncio.to_thread(warm_up))
+        # Следим за файлами с вопросами и подменяем банки на лету (questions.py не следим)
+        watchers = [asyncio.create_task(holder.watch(QUESTIONS_RELOAD_INTERVAL))
+                    for holder in quizzes.banks() if holder.path]
+        # Результаты других воркеров (и своя отложенная запись)
+        leaderboard_sync = [asyncio.create_task(quiz.leaderboard.watch()) for quiz in quizzes]
+        # Отложенная пакетная запись сессий и истории (SqliteSessionStore)
+        store_flush = [asyncio.create_task(store.watch()) for store in (user_data, history_store)]
+        timer_task = asyncio.create_task(timers.run(lambda key, payload: on_timer(application, key, payload)))
+        monitor_task = asyncio.create_task(loop_monitor.run())
+        print(f"✅ Бот запущен ({BOT_MODE})... Ждём /start")
+        print(f"⏱ Запуск: {startup.report()}")
+        try:
+            # serve() завершится по SIGINT/SIGTERM
+            await server.serve()
+        finally:
+            for task in watchers + leaderboard_sync + store_flush:
+                task.cancel()
+            timer_task.cancel()
+            monitor_task.cancel()
+            await asyncio.wait([warm])
+            await drain(application)
+            save_sessions()
+            await quizzes.close()
+            user_data.close()
+            history_store.close()
+
+
+async def set_webhook(bot: Bot, drop_pending_updates=False):
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        allowed_updates=ALLOWED_UPDATES,
+        drop_pending_updates=drop_pending_updates,
+        secret_token=WEBHOOK_SECRET,
+    )
+
 
+# === Маршрутизатор: принимает webhook и раскладывает обновления по воркерам ===
+async def serve_router(bot: Bot):
+    from cluster import WorkerPool, create_router_app
+    from web import WebServer
+
+    pool = None
+    worker_urls = WORKER_URLS
+    if not worker_urls:
+        env = {
+            # Лимит Telegram общий на бота — делим его между воркерами
+            "OUTBOX_GLOBAL_RATE": str(OUTBOX_GLOBAL_RATE / WORKERS),
+        }
+        if SESSION_STORE not in ("shared", "redis"):
+            # Сессии должны быть видны всем воркерам
+            print(f"⚠️ SESSION_STORE={SESSION_STORE} не подходит для воркеров, используем shared")
+            env["SESSION_STORE"] = "shared"
+        pool = WorkerPool(os.path.abspath(__file__), WORKERS, WORKER_BASE_PORT, env)
+        pool.start()
+        worker_urls = pool.urls
+
+    web_app = create_router_app(worker_urls, WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+    server = WebServer.for_app(web_app, PORT)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, server.handle_exit, sig, None)
+
+    async with bot:
+        # Воркеры хранят сессии в общем хранилище — обновления, пришедшие за время перезапуска, не теряем
+        await set_webhook(bot)
+    supervisor = asyncio.create_task(pool.watch()) if pool else None
+    print(f"✅ Маршрутизатор запущен: {len(worker_urls)} воркеров")
+    try:
+        await server.serve()
+    finally:
+        if supervisor is not None:
+            supervisor.cancel()
+            await pool.stop()
 
 
+# === Запуск бота ===
+if __name__ == "__main__":
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        print("❌ ОШИБКА: Не задан BOT_TOKEN в переменных окружения!")
+        exit(1)
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        print("❌ ОШИБКА: Для BOT_MODE=webhook нужен WEBHOOK_URL!")
+        exit(1)
 
+    # Создаём приложение (пул соединений и таймауты — из BOT_API_* переменных)
+    request, get_updates_request = build_requests()
 
+    try:
+        if ROUTER:
+            # BOT_API_BASE_URL — например, локальный Bot API из bench/
+            bot_kwargs = {"base_url": BOT_API_BASE_URL} if BOT_API_BASE_URL else {}
+            asyncio.run(serve_router(Bot(token, request=request, **bot_kwargs)))
+        else:
+            application = build_application(
+                token, request=request, get_updates_request=get_updates_request,
+                base_url=BOT_API_BASE_URL)
+            print(f"🌐 Bot API: HTTP/{request.http_version}, пул {request.pool_size} соединений")
+            asyncio.run(serve(application))
+    except KeyboardInterrupt:
+        pass
+    print("\nБот остановлен.")
@@ -0,0 +1,139 @@
+# cluster.py — несколько процессов бота за одним приёмником webhook
+# Маршрутизатор принимает обновления от Telegram и пересылает каждое воркеру
+# по user_id: обновления одного пользователя всегда попадают в один процесс
+# (и там идут по очереди), разные пользователи расходятся по ядрам.
+# Воркер — обычный bot.py в режиме BOT_MODE=worker. Сессии лежат в общем
+# хранилище (SESSION_STORE=shared или redis), поэтому перезапуск воркера
+# или смена их числа не обрывает начатые тесты.
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+
+from metrics import ERRORS, registry
+from web import SECRET_HEADER, home, metrics
+
+logger = logging.getLogger(__name__)
+
+ROUTED = registry.counter(
+    "bot_router_updates_total", "Обновления, пересланные воркерам", ["worker"])
+
+
+# === Маршрутизация ===
+def update_user_id(payload):
+    # Обновление — update_id плюс один объект: message, callback_query, inline_query...
+    for key, value in payload.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if user:
+            return user.get("id")
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat.get("id")
+    return None
+
+
+def shard_for(user_id, workers):
+    # id пользователей Telegram распределены равномерно — остатка от деления достаточно
+    return user_id % workers
+
+
+def create_router_app(worker_urls, webhook_path, secret_token=None, timeout=10.0):
+    targets = [url.rstrip("/") + webhook_path for url in worker_urls]
+    headers = {"content-type": "application/json"}
+    if secret_token:
+        headers[SECRET_HEADER] = secret_token
+    client = httpx.AsyncClient(timeout=timeout)
+
+    async def telegram_webhook(request):
+        if secret_token and request.headers.get(SECRET_HEADER) != secret_token:
+            return Response(status_code=403)
+        body = await request.body()
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return Response(status_code=400)
+        if not isinstance(payload, dict):
+            return Response(status_code=400)
+        user_id = update_user_id(payload)
+        worker = shard_for(user_id, len(targets)) if user_id is not None else 0
+        try:
+            # Тело пересылаем как есть — без разбора в Update
+            response = await client.post(targets[worker], content=body, headers=headers)
+        except httpx.HTTPError as e:
+            ERRORS.inc("router", type(e).__name__)
+            # Воркер недоступен — Telegram повторит доставку
+            return Response(status_code=503)
+        ROUTED.inc(str(worker))
+        return Response(status_code=response.status_code)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        yield
+        await client.aclose()
+
+    return Starlette(
+        routes=[
+            Route("/", home, methods=["GET", "HEAD"]),
+            Route("/metrics", metrics),
+            Route(webhook_path, telegram_webhook, methods=["POST"]),
+        ],
+        lifespan=lifespan,
+    )
+
+
+# === Локальные воркеры ===
+class WorkerPool:
+    def __init__(self, script, count, base_port, env=None):
+        self.script = script
+        self.count = count
+        self.base_port = base_port
+        # Переменные окружения поверх унаследованных (режим, хранилище, лимиты)
+        self.env = env or {}
+        self._processes = [None] * count
+
+    @property
+    def urls(self):
+        return [f"http://127.0.0.1:{self.base_port + i}" for i in range(self.count)]
+
+    def _spawn(self, index):
+        env = dict(os.environ, **self.env)
+        env["BOT_MODE"] = "worker"
+        env["PORT"] = str(self.base_port + index)
+        env["WORKER_INDEX"] = str(index)
+        self._processes[index] = subprocess.Popen([sys.executable, self.script], env=env)
+
+    def start(self):
+        for index in range(self.count):
+            self._spawn(index)
+
+    async def watch(self, interval=1.0):
+        # Упавший воркер перезапускаем: его пользователи продолжат тест с того же места
+        while True:
+            await asyncio.sleep(interval)
+            for index, process in enumerate(self._processes):
+                if process is not None and process.poll() is not None:
+                    ERRORS.inc("worker_exit", str(process.returncode))
+                    logger.error("Воркер %d завершился с кодом %s, перезапускаем", index, process.returncode)
+                    self._spawn(index)
+
+    async def stop(self, timeout=15.0):
+        processes = [p for p in self._processes if p is not None and p.poll() is None]
+        for process in processes:
+            process.send_signal(signal.SIGTERM)
+        for process in processes:
+            try:
+                await asyncio.to_thread(process.wait, timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
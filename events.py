@@ -0,0 +1,286 @@
+# events.py — журнал событий (ответы и завершённые тесты) и статистика по вопросам
+# Хендлер только добавляет событие в список в памяти; фоновая задача раз в
+# flush_interval (или при накоплении batch_size) дописывает пачку в JSON Lines
+# в отдельном потоке. Большой файл ротируется и сжимается в .jsonl.gz.
+#
+# Статистика по вопросам (попытки, точность, среднее время ответа, точность
+# после пояснения) обновляется при записи пачки и читается за O(1).
+# Снимок статистики сохраняется при ротации; к нему досчитывается текущий
+# файл журнала — при первом обращении к stats, а не при создании журнала.
+#
+# Самые трудные вопросы по всем журналам в каталоге:
+#   python events.py events/
+
+import asyncio
+import glob
+import gzip
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# === Статистика по вопросам ===
+class QuestionStats:
+    def __init__(self):
+        # question_id -> [попыток, верных, сумма секунд, попыток после пояснения, из них верных]
+        self._items = {}
+
+    def add(self, question_id, correct, seconds, retry=False):
+        item = self._items.get(question_id)
+        if item is None:
+            item = self._items[question_id] = [0, 0, 0.0, 0, 0]
+        item[0] += 1
+        item[1] += correct
+        item[2] += seconds
+        if retry:
+            item[3] += 1
+            item[4] += correct
+
+    def get(self, question_id):
+        item = self._items.get(question_id)
+        if item is None:
+            return None
+        attempts, correct, seconds, retries, retries_correct = item
+        return {
+            "attempts": attempts,
+            "accuracy": correct / attempts,
+            "avg_seconds": seconds / attempts,
+            # Ответы на вопрос, в котором пользователь уже ошибался и видел пояснение
+            "retries": retries,
+            "retry_accuracy": retries_correct / retries if retries else None,
+        }
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def merge(self, other):
+        for question_id, item in other._items.items():
+            mine = self._items.get(question_id)
+            if mine is None:
+                self._items[question_id] = list(item)
+            else:
+                for i, value in enumerate(item):
+                    mine[i] += value
+
+    def apply(self, event):
+        if event.get("type") == "answer":
+            self.add(event["question"], event["correct"], event["seconds"], event.get("retry", False))
+
+    def to_dict(self):
+        return {str(question_id): item for question_id, item in self._items.items()}
+
+    @classmethod
+    def from_dict(cls, raw):
+        stats = cls()
+        stats._items = {int(question_id): list(item) for question_id, item in raw.items()}
+        return stats
+
+
+# === Журнал ===
+class EventLog:
+    def __init__(self, directory, name="events", batch_size=500, flush_interval=1.0,
+                 max_bytes=16 * 1024 * 1024, max_pending=100000, clock=time.time):
+        self.directory = directory
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_pending = max_pending
+        self._clock = clock
+        self.path = os.path.join(directory, name + ".jsonl")
+        self.snapshot_path = os.path.join(directory, name + ".stats.json")
+        self._buffer = []
+        self._file = None
+        # Запись идёт в потоке; на остановке она может пересечься с последней пачкой
+        self._file_lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self.written = 0
+        self.dropped = 0
+        self.rotated = 0
+        os.makedirs(directory, exist_ok=True)
+        self._stats = None
+        self._stats_lock = threading.Lock()
+
+    @property
+    def stats(self):
+        # Досчёт журнала может занять время — не на старте, а при первом обращении
+        if self._stats is None:
+            with self._stats_lock:
+                if self._stats is None:
+                    self._stats = load_stats(self.path, self.snapshot_path)
+        return self._stats
+
+    # --- Вызываются из хендлеров: только добавление в список ---
+    def answer(self, user_id, question_id, bank_version, choice, correct, seconds, retry=False):
+        self._append({
+            "type": "answer",
+            "time": round(self._clock(), 3),
+            "user": user_id,
+            "question": question_id,
+            "version": bank_version,
+            "choice": choice,
+            "correct": correct,
+            "seconds": round(seconds, 3),
+            "retry": retry,
+        })
+
+    def completed(self, user_id, bank_version, correct, total, seconds):
+        self._append({
+            "type": "completed",
+            "time": round(self._clock(), 3),
+            "user": user_id,
+            "version": bank_version,
+            "correct": correct,
+            "total": total,
+            "seconds": round(seconds, 3),
+        })
+
+    def _append(self, event):
+        if len(self._buffer) >= self.max_pending:
+            # Диск не успевает — теряем событие, но не задерживаем ответ
+            self.dropped += 1
+            return
+        self._buffer.append(event)
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    def stats_summary(self):
+        return {
+            "pending": len(self._buffer),
+            "written": self.written,
+            "dropped": self.dropped,
+            "rotated": self.rotated,
+        }
+
+    # --- Фоновая запись ---
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        try:
+            await asyncio.to_thread(self._write, batch)
+        except OSError as e:
+            self.dropped += len(batch)
+            logger.error("Журнал событий: не удалось записать %d событий: %s", len(batch), e)
+
+    def _write(self, batch):
+        lines = "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in batch)
+        with self._file_lock:
+            # Статистику читаем до записи: иначе досчёт файла учтёт эту пачку,
+            # а затем apply() добавит её ещё раз
+            stats = self.stats
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(lines)
+            self._file.flush()
+            for event in batch:
+                stats.apply(event)
+            self.written += len(batch)
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        # Сначала снимок статистики (он уже учитывает весь текущий файл), потом ротация
+        save_stats(self.stats, self.snapshot_path)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(self._clock()))
+        base = os.path.join(self.directory, f"{self.name}-{stamp}")
+        rotated, n = base + ".jsonl", 1
+        while os.path.exists(rotated + ".gz"):
+            rotated, n = f"{base}-{n}.jsonl", n + 1
+        os.replace(self.path, rotated)
+        with open(rotated, "rb") as src, gzip.open(rotated + ".gz.tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(rotated + ".gz.tmp", rotated + ".gz")
+        os.remove(rotated)
+        self.rotated += 1
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        await self.flush()
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# === Снимок статистики ===
+def save_stats(stats, path):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(stats.to_dict(), f)
+    os.replace(tmp, path)
+
+
+def load_stats(log_path, snapshot_path):
+    try:
+        with open(snapshot_path, encoding="utf-8") as f:
+            stats = QuestionStats.from_dict(json.load(f))
+    except FileNotFoundError:
+        stats = QuestionStats()
+    except ValueError as e:
+        logger.error("Снимок статистики %s повреждён: %s", snapshot_path, e)
+        stats = QuestionStats()
+    # Текущий файл ещё не вошёл в снимок — досчитываем
+    try:
+        with open(log_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    stats.apply(json.loads(line))
+                except (ValueError, KeyError):
+                    # Оборванная последняя строка после аварийной остановки
+                    continue
+    except FileNotFoundError:
+        pass
+    return stats
+
+
+def load_all_stats(directory):
+    # Статистика всех воркеров, пишущих в каталог. Сразу после ротации текущего
+    # файла ещё нет — тогда у журнала остался только снимок
+    pattern = os.path.join(glob.escape(directory), "*")
+    names = {os.path.basename(path)[:-len(".jsonl")] for path in glob.glob(pattern + ".jsonl")}
+    names |= {os.path.basename(path)[:-len(".stats.json")] for path in glob.glob(pattern + ".stats.json")}
+    total = QuestionStats()
+    for name in sorted(names):
+        total.merge(load_stats(os.path.join(directory, name + ".jsonl"),
+                               os.path.join(directory, name + ".stats.json")))
+    return total
+
+
+# === Самые трудные вопросы ===
+if __name__ == "__main__":
+    import sys
+
+    directory = sys.argv[1] if len(sys.argv) > 1 else "events"
+    total = load_all_stats(directory)
+    rows = sorted(((total.get(q), q) for q in total), key=lambda row: row[0]["accuracy"])
+    print(f"{'вопрос':>8} {'попыток':>8} {'точность':>9} {'сек':>6} {'после пояснения':>16}")
+    for stat, question_id in rows[:20]:
+        retry = stat["retry_accuracy"]
+        retry_text = f"{retry:.0%} из {stat['retries']}" if retry is not None else "—"
+        print(f"{question_id + 1:>8} {stat['attempts']:>8} {stat['accuracy']:>9.0%} "
+              f"{stat['avg_seconds']:>6.1f} {retry_text:>16}")
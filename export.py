@@ -0,0 +1,239 @@
+# export.py — выгрузка результатов для администраторов (CSV или JSON Lines)
+# Всё построено на генераторах: строки читаются из хранилища по одной и
+# отдаются кусками по CHUNK_SIZE байт, память не зависит от объёма выгрузки.
+# Фильтры применяются как можно ближе к данным:
+#   results     — завершённые тесты из журналов событий (events.py); сжатые
+#                 журналы, ротированные раньше начала периода, не открываются,
+#                 строки других событий отбрасываются до разбора JSON
+#   leaderboard — лучшие результаты из SQLite рейтинга, фильтр в WHERE
+#   questions   — статистика по вопросам (фильтры не применяются)
+#
+# Фильтры: since / until (YYYY-MM-DD, UTC, обе границы включительно),
+# min_score / max_score (число правильных ответов).
+# Тест (см. quizzes.py) выбирается параметром quiz=<id>, по умолчанию — первый.
+
+import csv
+import glob
+import gzip
+import io
+import json
+import os
+import re
+import sqlite3
+from datetime import date, datetime, timedelta, timezone
+
+from events import load_all_stats
+
+KINDS = ("results", "leaderboard", "questions")
+FORMATS = ("csv", "jsonl")
+FILTERS = ("since", "until", "min_score", "max_score")
+CHUNK_SIZE = 64 * 1024
+
+COLUMNS = {
+    "results": ("time", "user_id", "bank_version", "correct", "total", "seconds"),
+    "leaderboard": ("user_id", "name", "correct", "total", "seconds", "updated_at"),
+    "questions": ("question", "text", "attempts", "accuracy", "avg_seconds", "retries", "retry_accuracy"),
+}
+
+# Время ротации в имени сжатого журнала: events-20261018-120000(-1).jsonl.gz
+_ROTATED = re.compile(r"-(\d{8}-\d{6})(?:-\d+)?\.jsonl\.gz$")
+
+
+class ExportError(ValueError):
+    pass
+
+
+# === Разбор параметров (из команды бота и из query string) ===
+def _day_start(value):
+    try:
+        day = date.fromisoformat(value)
+    except ValueError as e:
+        raise ExportError(f"Дата {value!r}: нужен формат YYYY-MM-DD") from e
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp()
+
+
+def _score(value):
+    try:
+        return int(value)
+    except ValueError as e:
+        raise ExportError(f"Счёт {value!r}: нужно целое число") from e
+
+
+def parse_filters(params):
+    unknown = set(params) - set(FILTERS)
+    if unknown:
+        raise ExportError(f"Неизвестные параметры: {', '.join(sorted(unknown))}")
+    filters = {}
+    if params.get("since"):
+        filters["since"] = _day_start(params["since"])
+    if params.get("until"):
+        # Включительно: до начала следующего дня
+        filters["until"] = _day_start(params["until"]) + timedelta(days=1).total_seconds()
+    for name in ("min_score", "max_score"):
+        if params.get(name):
+            filters[name] = _score(params[name])
+    return filters
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _matches(timestamp, score, since=None, until=None, min_score=None, max_score=None):
+    return ((since is None or timestamp >= since)
+            and (until is None or timestamp < until)
+            and (min_score is None or score >= min_score)
+            and (max_score is None or score <= max_score))
+
+
+# === Источники строк ===
+def _log_files(directory, since=None):
+    # Сжатые журналы — по времени ротации, затем текущие файлы воркеров
+    rotated = []
+    for path in glob.glob(os.path.join(glob.escape(directory), "*.jsonl.gz")):
+        match = _ROTATED.search(path)
+        if match is None:
+            continue
+        rotated_at = datetime.strptime(match.group(1), "%Y%m%d-%H%M%S").replace(tzinfo=timezone.utc).timestamp()
+        # Все события файла записаны до его ротации
+        if since is not None and rotated_at < since:
+            continue
+        rotated.append((rotated_at, path))
+    for _, path in sorted(rotated):
+        yield path
+    yield from sorted(glob.glob(os.path.join(glob.escape(directory), "*.jsonl")))
+
+
+def iter_results(directory, **filters):
+    for path in _log_files(directory, filters.get("since")):
+        opener = gzip.open if path.endswith(".gz") else open
+        try:
+            f = opener(path, "rt", encoding="utf-8")
+        except FileNotFoundError:
+            # Журнал ротировали, пока шла выгрузка
+            continue
+        with f:
+            for line in f:
+                if '"completed"' not in line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # Оборванная последняя строка текущего журнала
+                    continue
+                if event.get("type") != "completed":
+                    continue
+                if not _matches(event["time"], event["correct"], **filters):
+                    continue
+                yield (_iso(event["time"]), event["user"], event["version"],
+                       event["correct"], event["total"], event["seconds"])
+
+
+def iter_leaderboard(path, table="leaderboard", since=None, until=None, min_score=None, max_score=None):
+    where, args = [], []
+    for clause, value in (("updated_at >= ?", since), ("updated_at < ?", until),
+                          ("correct >= ?", min_score), ("correct <= ?", max_score)):
+        if value is not None:
+            where.append(clause)
+            args.append(value)
+    query = f"SELECT user_id, name, correct, total, seconds, updated_at FROM {table}"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    # Своё соединение только для чтения: выгрузка идёт в потоке и не мешает записи.
+    # Части выгрузки читаются через asyncio.to_thread / iterate_in_threadpool, и
+    # каждая может попасть в другой поток пула, а закрывает генератор цикл событий;
+    # соединением пользуется один читатель за раз, поэтому проверка потока отключена
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    try:
+        for user_id, name, correct, total, seconds, updated_at in db.execute(query + " ORDER BY seq", args):
+            yield user_id, name, correct, total, round(seconds, 3), _iso(updated_at)
+    finally:
+        db.close()
+
+
+def iter_questions(directory, bank=None):
+    stats = load_all_stats(directory)
+    for question_id in sorted(stats):
+        item = stats.get(question_id)
+        text = bank[question_id].question if bank is not None and question_id < len(bank) else ""
+        retry = item["retry_accuracy"]
+        yield (question_id + 1, text, item["attempts"], round(item["accuracy"], 4),
+               round(item["avg_seconds"], 3), item["retries"], round(retry, 4) if retry is not None else None)
+
+
+# === Форматы ===
+def _csv_chunks(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def _jsonl_chunks(columns, rows):
+    lines, size = [], 0
+    for row in rows:
+        line = json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(lines).encode("utf-8")
+            lines, size = [], 0
+    if lines:
+        yield "".join(lines).encode("utf-8")
+
+
+# === Выгрузка ===
+class Exporter:
+    def __init__(self, quizzes):
+        # Журналы, рейтинг и банк каждого теста (quizzes.QuizRegistry)
+        self.quizzes = quizzes
+
+    def quiz(self, quiz_id=None):
+        if quiz_id is None:
+            return self.quizzes.default
+        quiz = self.quizzes.get(quiz_id)
+        if quiz is None:
+            raise ExportError(f"Неизвестный тест {quiz_id!r}: {', '.join(q.id for q in self.quizzes)}")
+        return quiz
+
+    def check(self, kind, fmt, quiz_id=None):
+        if kind not in KINDS:
+            raise ExportError(f"Неизвестная выгрузка {kind!r}: {', '.join(KINDS)}")
+        if fmt not in FORMATS:
+            raise ExportError(f"Неизвестный формат {fmt!r}: {', '.join(FORMATS)}")
+        self.quiz(quiz_id)
+
+    def filename(self, kind, fmt, quiz_id=None):
+        prefix = f"{kind}-{quiz_id}" if quiz_id else kind
+        return f"{prefix}-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.{fmt}"
+
+    def rows(self, kind, quiz_id=None, **filters):
+        quiz = self.quiz(quiz_id)
+        if kind == "results":
+            return iter_results(quiz.events.directory, **filters)
+        if kind == "leaderboard":
+            return iter_leaderboard(quiz.leaderboard.path, quiz.leaderboard.table, **filters)
+        return iter_questions(quiz.events.directory, quiz.banks.current)
+
+    def stream(self, kind, fmt, quiz_id=None, **filters):
+        # Генератор кусков bytes; блокирующий — итерировать в потоке
+        self.check(kind, fmt, quiz_id)
+        chunks = _csv_chunks if fmt == "csv" else _jsonl_chunks
+        return chunks(COLUMNS[kind], self.rows(kind, quiz_id, **filters))
+
+
+def read_part(chunks, limit):
+    # Следующая часть: около limit байт (не больше limit + CHUNK_SIZE), строки не
+    # рвутся, потому что куски берутся целиком; b"" — выгрузка закончилась
+    part = bytearray()
+    for chunk in chunks:
+        part += chunk
+        if len(part) >= limit:
+            break
+    return bytes(part)
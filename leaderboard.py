@@ -0,0 +1,163 @@
+# leaderboard.py — рейтинг по завершённым тестам
+# В рейтинге лучший результат каждого пользователя: больше правильных, при
+# равенстве — быстрее. Порядок держит SortedList (sortedcontainers): вставка
+# результата и «ваше место X из N» стоят O(log n).
+#
+# Результаты хранятся в SQLite (пакетная запись, как в sessions.py). Если
+# файл общий для нескольких процессов (воркеры из cluster.py), sync()
+# подтягивает результаты, записанные другими процессами. У каждого теста
+# (см. quizzes.py) своя таблица в том же файле.
+# Загрузка с диска отложена до первого обращения (или load() в фоне после
+# запуска), чтобы большой рейтинг не задерживал старт бота.
+
+import asyncio
+import sqlite3
+import threading
+import time
+
+from sortedcontainers import SortedList
+
+
+class Leaderboard:
+    def __init__(self, path, table="leaderboard", batch_size=100, flush_interval=1.0, clock=time.time):
+        self.path = path
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._clock = clock
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            " user_id INTEGER PRIMARY KEY,"
+            " name TEXT NOT NULL,"
+            " correct INTEGER NOT NULL,"
+            " total INTEGER NOT NULL,"
+            " seconds REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " seq INTEGER NOT NULL)"
+        )
+        # seq растёт с каждой записью (писатели SQLite идут по очереди) — по нему sync()
+        # находит чужие результаты, не полагаясь на часы процессов
+        self._db.execute(f"CREATE INDEX IF NOT EXISTS {table}_seq ON {table}(seq)")
+        self._db.commit()
+        # (-правильных, секунд, user_id) — по возрастанию ключа от первого места к последнему
+        self._index = SortedList()
+        # user_id -> (ключ, имя, всего вопросов)
+        self._best = {}
+        # user_id -> строка для записи в БД
+        self._pending = {}
+        self._last_flush = clock()
+        self._synced_seq = 0
+        self._loaded = False
+        self._load_lock = threading.Lock()
+
+    def __len__(self):
+        self.load()
+        return len(self._index)
+
+    def _apply(self, user_id, name, correct, total, seconds):
+        # Оставляет лучший результат; True — если рейтинг изменился
+        key = (-correct, seconds, user_id)
+        old = self._best.get(user_id)
+        if old is not None:
+            if old[0] <= key:
+                return False
+            self._index.remove(old[0])
+        self._index.add(key)
+        self._best[user_id] = (key, name, total)
+        return True
+
+    def add(self, user_id, name, correct, total, seconds):
+        self.load()
+        if not self._apply(user_id, name, correct, total, seconds):
+            return False
+        self._pending[user_id] = (user_id, name, correct, total, seconds, self._clock())
+        if len(self._pending) >= self.batch_size or self._clock() - self._last_flush >= self.flush_interval:
+            self.flush()
+        return True
+
+    def rank(self, user_id):
+        # Место лучшего результата пользователя (одинаковый счёт и время — одно место)
+        self.load()
+        entry = self._best.get(user_id)
+        if entry is None:
+            return None
+        correct, seconds, _ = entry[0]
+        return self._index.bisect_left((correct, seconds)) + 1
+
+    def best(self, user_id):
+        # Лучший результат пользователя: (правильных, всего, секунд) или None
+        self.load()
+        entry = self._best.get(user_id)
+        if entry is None:
+            return None
+        (correct, seconds, _), _, total = entry
+        return -correct, total, seconds
+
+    def top(self, n=10):
+        self.load()
+        result = []
+        for key in self._index.islice(0, n):
+            correct, seconds, user_id = key
+            _, name, total = self._best[user_id]
+            result.append((user_id, name, -correct, total, seconds))
+        return result
+
+    # --- Диск ---
+    def load(self):
+        # Можно вызвать из потока заранее; повторные вызовы ничего не стоят
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            # Сотни тысяч строк: собираем ключи и сортируем один раз, а не вставляем по одному
+            cursor = self._db.execute(f"SELECT user_id, name, correct, total, seconds, seq FROM {self.table}")
+            for user_id, name, correct, total, seconds, seq in cursor:
+                self._best[user_id] = ((-correct, seconds, user_id), name, total)
+                self._synced_seq = max(self._synced_seq, seq)
+            self._index.update(entry[0] for entry in self._best.values())
+            self._loaded = True
+
+    def flush(self):
+        now = self._clock()
+        self._last_flush = now
+        if not self._pending:
+            return
+        rows, self._pending = list(self._pending.values()), {}
+        with self._db:
+            # Другой процесс мог записать результат лучше — не затираем его
+            self._db.executemany(
+                f"INSERT INTO {self.table} (user_id, name, correct, total, seconds, updated_at, seq)"
+                f" VALUES (?, ?, ?, ?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM {self.table}))"
+                " ON CONFLICT(user_id) DO UPDATE SET"
+                " name = excluded.name, correct = excluded.correct, total = excluded.total,"
+                " seconds = excluded.seconds, updated_at = excluded.updated_at, seq = excluded.seq"
+                f" WHERE excluded.correct > {self.table}.correct"
+                f" OR (excluded.correct = {self.table}.correct AND excluded.seconds < {self.table}.seconds)",
+                rows,
+            )
+
+    def sync(self):
+        # Результаты, записанные с прошлой синхронизации (в том числе свои — повтор безвреден)
+        if not self._loaded:
+            return
+        self.flush()
+        cursor = self._db.execute(
+            f"SELECT user_id, name, correct, total, seconds, seq FROM {self.table} WHERE seq > ? ORDER BY seq",
+            (self._synced_seq,),
+        )
+        for user_id, name, correct, total, seconds, seq in cursor:
+            self._apply(user_id, name, correct, total, seconds)
+            self._synced_seq = seq
+
+    async def watch(self, interval=5.0):
+        while True:
+            await asyncio.sleep(interval)
+            self.sync()
+
+    def close(self):
+        self.flush()
+        self._db.close()
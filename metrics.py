@@ -0,0 +1,156 @@
+# metrics.py — лёгкие метрики в формате Prometheus
+# Счётчики и гистограммы — обычные словари и списки в памяти процесса:
+# запись стоит один bisect и пару сложений, поэтому инструментирование можно
+# держать включённым в проде. Отдаются на /metrics (см. web.py).
+
+import functools
+import time
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# === Типы метрик ===
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по бакетам (+Inf последним), сумма]
+        self._values = {}
+
+    def observe(self, value, *labels):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def collect(self):
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _labels(self.labelnames, labels, 'le="%s"' % le)
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Gauge:
+    kind = "gauge"
+
+    # func() возвращает число или {кортеж значений меток: число}; считается только при выгрузке
+    def __init__(self, name, help, func, labelnames=()):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.labelnames = tuple(labelnames)
+
+    def collect(self):
+        value = self.func()
+        if isinstance(value, dict):
+            for labels, v in value.items():
+                yield f"{self.name}{_labels(self.labelnames, labels)} {v}"
+        else:
+            yield f"{self.name} {value}"
+
+
+# === Реестр ===
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        # Повторная регистрация с тем же именем заменяет метрику (например, новый Application)
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, func, labelnames=()):
+        return self.register(Gauge(name, help, func, labelnames))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                lines.extend(metric.collect())
+            except Exception as e:
+                lines.append(f"# {metric.name}: {type(e).__name__}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# === Общие метрики бота ===
+HANDLER_SECONDS = registry.histogram(
+    "bot_handler_seconds", "Время работы хендлера", ["handler"])
+HANDLER_ERRORS = registry.counter(
+    "bot_handler_errors_total", "Исключения в хендлерах по типу", ["handler", "error"])
+API_SECONDS = registry.histogram(
+    "bot_api_request_seconds", "Время HTTP-запроса к Bot API", ["method"])
+API_RESPONSES = registry.counter(
+    "bot_api_responses_total", "Ответы Bot API по HTTP-коду", ["method", "code"])
+API_ERRORS = registry.counter(
+    "bot_api_errors_total", "Сетевые ошибки запросов к Bot API", ["method", "error"])
+ERRORS = registry.counter(
+    "bot_errors_total", "Прочие перехваченные ошибки", ["source", "error"])
+STALE_CALLBACKS = registry.counter(
+    "bot_stale_callbacks_total", "Отброшенные нажатия: старая клавиатура, нет сессии или повтор", ["reason"])
+TIMEOUTS = registry.counter(
+    "bot_timeouts_total", "Сработавшие таймеры: неактивная сессия, время на вопрос", ["kind"])
+
+
+def instrument(name):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                HANDLER_ERRORS.inc(name, type(e).__name__)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+        return wrapper
+    return decorator
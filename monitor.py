@@ -0,0 +1,138 @@
+# monitor.py — здоровье event loop и профилирование живого процесса
+# LoopMonitor раз в interval (но не реже, чем раз в slow_threshold / 4)
+# засыпает на asyncio.sleep и меряет, насколько позже срока проснулся
+# (гистограмма bot_event_loop_lag_seconds). Отдельный поток-сторож с тем же
+# шагом смотрит, насколько loop опаздывает с ожидаемым пробуждением: если
+# дольше порога, он снимает стек потока loop и записывает, чья функция его
+# держит (bot_slow_callbacks_total{function}). Частое пробуждение нужно, чтобы
+# порог значил то, что написано: блокировка, начавшаяся сразу после
+# пробуждения, замечается, если длиннее slow_threshold в полтора раза, а не на
+# целый interval. В простое это десяток пробуждений корутины и потока в
+# секунду, поэтому монитор можно держать включённым в проде.
+#
+# sample_stacks() — сэмплирующий профайлер всех потоков на заданное время;
+# результат в формате collapsed stacks (flamegraph.pl, speedscope):
+#   MainThread;_run_module_as_main (runpy.py:173);... 42
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = registry.histogram(
+    "bot_event_loop_lag_seconds", "Опоздание пробуждения event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+SLOW_CALLBACKS = registry.counter(
+    "bot_slow_callbacks_total", "Блокировки event loop дольше порога по функциям", ["function"])
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+# === Монитор event loop ===
+class LoopMonitor:
+    def __init__(self, interval=0.5, slow_threshold=0.25):
+        # Шаг пробуждений: опоздание считается от ожидаемого срока, а срок
+        # наступает не позже чем через четверть порога после прошлого пробуждения
+        self.interval = min(interval, slow_threshold / 4)
+        self.slow_threshold = slow_threshold
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._loop_thread = None
+        self._stop = threading.Event()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        try:
+            while True:
+                started = loop.time()
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, loop.time() - started - self.interval)
+                LOOP_LAG.observe(lag)
+                self.max_lag = max(self.max_lag, lag)
+                self._beat = time.monotonic()
+        finally:
+            self._stop.set()
+
+    def stats(self):
+        return {"max_lag": self.max_lag, "stalls": self.stalls}
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            # Об одной блокировке сообщаем один раз
+            if blocked < self.slow_threshold or beat == reported:
+                continue
+            reported = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            function = _culprit(frame)
+            self.stalls += 1
+            SLOW_CALLBACKS.inc(function)
+            logger.warning(
+                "Event loop заблокирован дольше %.2f с в %s:\n%s",
+                blocked, function, "".join(traceback.format_stack(frame, limit=8)),
+            )
+
+
+def _culprit(frame):
+    # Ближайшая к месту блокировки функция бота; если таких нет — самая внутренняя
+    innermost = frame
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename.startswith(ROOT) and code.co_filename != __file__:
+            return f"{os.path.basename(code.co_filename)[:-3]}.{code.co_qualname}"
+        frame = frame.f_back
+    return innermost.f_code.co_qualname
+
+
+# === Сэмплирующий профайлер ===
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def _label(code):
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(duration, interval=0.005):
+    # Блокирующая функция — вызывать через asyncio.to_thread. Один профиль за раз.
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("Профилирование уже идёт")
+    try:
+        me = threading.get_ident()
+        counts = Counter()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                counts[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,319 @@
+# outbox.py — планировщик исходящих запросов к Bot API
+# Все send_message / edit_message_text идут через одну очередь:
+#   - общий и по-чатовый token bucket под лимиты Telegram
+#   - RetryAfter → пауза для чата и всей очереди (лимит бывает общим на бота) и повтор
+#   - сетевые сбои → пауза для чата и повтор, а не второй запрос
+#   - required=True — запрос несёт состояние теста (вопрос, пояснение, итоги):
+#     повторяется, пока не дойдёт, иначе пользователь застрянет со старой клавиатурой
+#   - несколько ещё не отправленных правок одного сообщения склеиваются в последнюю
+#   - сообщения в одном чате уходят строго по порядку
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+from metrics import ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Предел паузы между повторами после сетевого сбоя, сек
+MAX_BACKOFF = 30.0
+
+
+# === Token bucket ===
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def ready_at(self, now):
+        # Когда можно будет взять целый токен
+        self._refill(now)
+        at = now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate
+        return max(at, self.blocked_until)
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until):
+        self.blocked_until = max(self.blocked_until, until)
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class _Job:
+    __slots__ = ("method", "chat_id", "kwargs", "key", "fallback", "required", "futures", "attempts")
+
+    def __init__(self, method, chat_id, kwargs, key, fallback, future, required=False):
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.key = key
+        self.fallback = fallback
+        self.required = required
+        self.futures = [future]
+        self.attempts = 0
+
+
+def _seconds(value):
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+# === Очередь исходящих запросов ===
+class Outbox:
+    def __init__(self, bot=None, global_rate=30.0, chat_rate=1.0, chat_burst=3,
+                 max_retries=3, clock=time.monotonic):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._clock = clock
+        self._global = TokenBucket(global_rate, global_rate, clock())
+        self._buckets = {}       # chat_id -> TokenBucket
+        self._queues = {}        # chat_id -> deque[_Job]
+        self._edits = {}         # (chat_id, message_id) -> ещё не отправленная правка
+        self._heap = []          # (когда чат готов, seq, chat_id)
+        self._scheduled = set()  # чаты, уже стоящие в _heap
+        self._in_flight = set()  # чаты, у которых запрос уже в пути
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._worker = None
+        self._tasks = set()
+        self._last_prune = clock()
+        self.depth = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.failed = 0
+
+    # --- Публичные методы: возвращают future с результатом (или None при ошибке) ---
+    def send_message(self, chat_id, text, required=False, **kwargs):
+        return self._submit("send_message", chat_id, dict(text=text, **kwargs), required=required)
+
+    def send_document(self, chat_id, document, filename, **kwargs):
+        return self._submit("send_document", chat_id, dict(document=document, filename=filename, **kwargs))
+
+    def edit_message_text(self, chat_id, message_id, text, fallback_to_send=False, required=False, **kwargs):
+        # Если сообщение нельзя отредактировать — отправляем новое (один раз, без гонки)
+        return self._submit(
+            "edit_message_text",
+            chat_id,
+            dict(message_id=message_id, text=text, **kwargs),
+            key=(chat_id, message_id),
+            fallback=fallback_to_send,
+            required=required,
+        )
+
+    def stats(self):
+        return {
+            "queued": self.depth,
+            "chats_waiting": len(self._queues),
+            "in_flight": len(self._in_flight),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "failed": self.failed,
+        }
+
+    async def stop(self, timeout=10.0):
+        # Даём очереди догрузиться, потом останавливаем воркер
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Outbox: не успели отправить %d запросов", self.depth)
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        for queue in self._queues.values():
+            for job in queue:
+                self._resolve(job, None)
+        self._queues.clear()
+        self._edits.clear()
+        self._heap.clear()
+        self._scheduled.clear()
+        self.depth = 0
+
+    # --- Постановка в очередь ---
+    def _submit(self, method, chat_id, kwargs, key=None, fallback=False, required=False):
+        future = asyncio.get_running_loop().create_future()
+        if key is not None:
+            job = self._edits.get(key)
+            if job is not None:
+                # Правка ещё не ушла — просто подменяем текст на свежий
+                job.kwargs = kwargs
+                job.fallback = job.fallback or fallback
+                job.required = job.required or required
+                job.futures.append(future)
+                self.coalesced += 1
+                return future
+        job = _Job(method, chat_id, kwargs, key, fallback, future, required)
+        if key is not None:
+            self._edits[key] = job
+        self._queues.setdefault(chat_id, deque()).append(job)
+        self.depth += 1
+        self._idle.clear()
+        self._schedule(chat_id)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+        return future
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, self._clock())
+        return bucket
+
+    def _schedule(self, chat_id):
+        if chat_id in self._scheduled or chat_id in self._in_flight or chat_id not in self._queues:
+            return
+        ready_at = self._bucket(chat_id).ready_at(self._clock())
+        heapq.heappush(self._heap, (ready_at, next(self._seq), chat_id))
+        self._scheduled.add(chat_id)
+        self._wakeup.set()
+
+    # --- Воркер ---
+    async def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = self._clock()
+            ready_at, _, chat_id = self._heap[0]
+            delay = max(ready_at, self._global.ready_at(now)) - now
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            self._scheduled.discard(chat_id)
+            bucket = self._bucket(chat_id)
+            if bucket.ready_at(now) > now:
+                # Чат успели заблокировать (RetryAfter) — переставляем в очередь
+                self._schedule(chat_id)
+                continue
+
+            queue = self._queues[chat_id]
+            job = queue.popleft()
+            if not queue:
+                del self._queues[chat_id]
+            if job.key is not None and self._edits.get(job.key) is job:
+                del self._edits[job.key]
+            self.depth -= 1
+            bucket.take(now)
+            self._global.take(now)
+            self._in_flight.add(chat_id)
+            task = asyncio.get_running_loop().create_task(self._dispatch(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            self._prune(now)
+
+    async def _dispatch(self, job):
+        try:
+            result = await getattr(self.bot, job.method)(chat_id=job.chat_id, **job.kwargs)
+        except RetryAfter as e:
+            # Telegram сам назвал срок: ждём его всей очередью (429 часто означает
+            # общий лимит бота) и повторяем без счёта попыток
+            until = self._clock() + _seconds(e.retry_after)
+            self._bucket(job.chat_id).block(until)
+            self._global.block(until)
+            self.retries += 1
+            self._requeue(job)
+        except BadRequest as e:
+            if "not modified" in e.message:
+                self.sent += 1
+                self._resolve(job, None)
+            # Ошибка разметки повторится и в новом сообщении — его не отправляем
+            elif (job.fallback and job.method == "edit_message_text"
+                    and "can't parse entities" not in e.message):
+                job.method = "send_message"
+                job.kwargs = {k: v for k, v in job.kwargs.items() if k != "message_id"}
+                job.key = None
+                self._requeue(job)
+            else:
+                self._fail(job, e)
+        except TimedOut as e:
+            # Правку можно безопасно повторить, новое сообщение — нет (может задвоиться);
+            # но потерянный вопрос хуже задвоенного
+            if job.method == "edit_message_text" or job.required:
+                self._backoff(job, e)
+            else:
+                self._fail(job, e)
+        except NetworkError as e:
+            self._backoff(job, e)
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self.sent += 1
+            self._resolve(job, result)
+        finally:
+            self._in_flight.discard(job.chat_id)
+            self._schedule(job.chat_id)
+            if not self.depth and not self._in_flight:
+                self._idle.set()
+
+    def _backoff(self, job, error):
+        self._bucket(job.chat_id).block(self._clock() + min(0.5 * 2 ** job.attempts, MAX_BACKOFF))
+        self._retry(job, error)
+
+    def _retry(self, job, error):
+        job.attempts += 1
+        if job.attempts > self.max_retries:
+            if not job.required:
+                self._fail(job, error)
+                return
+            logger.warning("Outbox: %s в чат %s, попытка %d: %r", job.method, job.chat_id, job.attempts, error)
+        self.retries += 1
+        self._requeue(job)
+
+    def _requeue(self, job):
+        self._queues.setdefault(job.chat_id, deque()).appendleft(job)
+        if job.key is not None:
+            self._edits.setdefault(job.key, job)
+        self.depth += 1
+
+    def _fail(self, job, error):
+        self.failed += 1
+        ERRORS.inc("outbox", type(error).__name__)
+        logger.warning("Outbox: %s в чат %s не отправлен: %r", job.method, job.chat_id, error)
+        self._resolve(job, None)
+
+    @staticmethod
+    def _resolve(job, result):
+        for future in job.futures:
+            if not future.done():
+                future.set_result(result)
+
+    def _prune(self, now):
+        # Раз в минуту забываем бакеты чатов, которые давно ничего не отправляли
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        for chat_id in [c for c, b in self._buckets.items() if b.idle(now)]:
+            if chat_id not in self._queues and chat_id not in self._in_flight:
+                del self._buckets[chat_id]
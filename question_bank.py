@@ -0,0 +1,186 @@
+# question_bank.py — скомпилированный банк вопросов
+# Текст и клавиатура каждого вопроса собираются один раз при загрузке,
+# а в обработчиках остаётся только короткий заголовок "Вопрос N из M".
+# Пояснение после ошибки заранее экранируется в HTML: разметка в тексте вопроса
+# (*, _, [) не может сломать отправку. Длина сообщений проверяется при загрузке.
+# В callback_data кнопок — метка вопроса сессии (см. Session.tag): нажатие на
+# старую клавиатуру или повторное нажатие отбрасывается без лишних запросов.
+
+from collections import OrderedDict
+from html import escape, unescape
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+REQUIRED_FIELDS = ("question", "options", "correct", "explanation")
+BUTTONS_PER_ROW = 4
+# Лимиты Telegram: текст сообщения и кнопки инлайн-клавиатуры
+MAX_MESSAGE_LENGTH = 4096
+MAX_OPTIONS = 100
+# Запас под заголовки, которые хендлеры добавляют к готовому тексту
+# ("⏰ Время на вопрос N вышло.", "📝 Вопрос N из M:")
+HEADER_RESERVE = 100
+
+
+class QuestionBankError(ValueError):
+    pass
+
+
+# === Один скомпилированный вопрос (неизменяемый) ===
+class CompiledQuestion:
+    __slots__ = ("question", "options", "correct", "explanation", "body", "feedback")
+
+    def __init__(self, question, options, correct, explanation):
+        set_ = object.__setattr__
+        set_(self, "question", question)
+        set_(self, "options", tuple(options))
+        set_(self, "correct", correct)
+        set_(self, "explanation", explanation)
+        set_(self, "body", _render_body(question, self.options))
+        set_(self, "feedback", _render_feedback(question, self.options, correct, explanation))
+
+    @classmethod
+    def from_cache(cls, question, options, correct, explanation, body, feedback):
+        # Из кэша банка (см. bank_loader): уже проверено и отрисовано
+        q = cls.__new__(cls)
+        set_ = object.__setattr__
+        set_(q, "question", question)
+        set_(q, "options", options)
+        set_(q, "correct", correct)
+        set_(q, "explanation", explanation)
+        set_(q, "body", body)
+        set_(q, "feedback", feedback)
+        return q
+
+    def to_cache(self):
+        return (self.question, self.options, self.correct, self.explanation, self.body, self.feedback)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledQuestion неизменяем")
+
+    def __delattr__(self, name):
+        raise AttributeError("CompiledQuestion неизменяем")
+
+    @property
+    def correct_option(self):
+        return self.options[self.correct]
+
+    def keyboard(self, tag):
+        return answer_keyboard(len(self.options), tag)
+
+
+def _render_body(question, options):
+    lines = [question, ""]
+    lines.extend(f"{i}. {option}" for i, option in enumerate(options, start=1))
+    lines.append("")
+    lines.append("🔢 Выберите номер ответа:")
+    return "\n".join(lines)
+
+
+def _render_feedback(question, options, correct, explanation):
+    # HTML (parse_mode="HTML"): экранировать нужно только <, > и &
+    return (
+        f"❌ Неправильно.\n\n"
+        f"📌 <b>Вопрос:</b> {escape(question, quote=False)}\n\n"
+        f"✅ <b>Правильный ответ:</b> {correct + 1}. {escape(options[correct], quote=False)}\n\n"
+        f"📘 <b>Пояснение:</b>\n{escape(explanation, quote=False)}"
+    )
+
+
+def _text_length(text):
+    # Telegram считает длину в кодовых единицах UTF-16 (эмодзи — две)
+    return len(text.encode("utf-16-le")) // 2
+
+
+# Клавиатуры зависят только от числа вариантов и метки вопроса (256 значений
+# nonce × номер вопроса) — общие для всех сессий, самые ходовые держим в LRU
+KEYBOARD_CACHE_SIZE = 16384
+_keyboards = OrderedDict()
+
+
+def _cached_keyboard(key, build):
+    markup = _keyboards.get(key)
+    if markup is None:
+        markup = _keyboards[key] = build()
+        if len(_keyboards) > KEYBOARD_CACHE_SIZE:
+            _keyboards.popitem(last=False)
+    else:
+        _keyboards.move_to_end(key)
+    return markup
+
+
+def _build_answer_keyboard(count, tag):
+    buttons = [
+        InlineKeyboardButton(str(i + 1), callback_data=f"ans_{i}_{tag}")
+        for i in range(count)
+    ]
+    rows = [buttons[i:i + BUTTONS_PER_ROW] for i in range(0, count, BUTTONS_PER_ROW)]
+    return InlineKeyboardMarkup(rows)
+
+
+def answer_keyboard(count, tag):
+    return _cached_keyboard((count, tag), lambda: _build_answer_keyboard(count, tag))
+
+
+def next_keyboard(tag):
+    return _cached_keyboard(("next", tag), lambda: InlineKeyboardMarkup(
+        [[InlineKeyboardButton("➡️ Следующий вопрос", callback_data=f"next_{tag}")]]))
+
+
+# === Проверка и компиляция ===
+def validate_question(raw, position=0):
+    if not isinstance(raw, dict):
+        raise QuestionBankError(f"Вопрос #{position}: ожидался dict, получено {type(raw).__name__}")
+    missing = [field for field in REQUIRED_FIELDS if field not in raw]
+    if missing:
+        raise QuestionBankError(f"Вопрос #{position}: нет полей {', '.join(missing)}")
+    options = raw["options"]
+    if not isinstance(options, (list, tuple)) or not options:
+        raise QuestionBankError(f"Вопрос #{position}: пустой список вариантов")
+    if len(options) > MAX_OPTIONS:
+        raise QuestionBankError(f"Вопрос #{position}: {len(options)} вариантов, допустимо не больше {MAX_OPTIONS}")
+    correct = raw["correct"]
+    if isinstance(correct, bool) or not isinstance(correct, int) or not 0 <= correct < len(options):
+        raise QuestionBankError(f"Вопрос #{position}: индекс правильного ответа {correct!r} вне диапазона")
+    for field in ("question", "explanation"):
+        if not str(raw[field]).strip():
+            raise QuestionBankError(f"Вопрос #{position}: пустое поле {field}")
+    options = [str(option) for option in options]
+    if not all(option.strip() for option in options):
+        raise QuestionBankError(f"Вопрос #{position}: пустой вариант ответа")
+    # Проверяем и ленивые банки, которые компилируют вопрос только при показе
+    _check_length(str(raw["question"]), options, correct, str(raw["explanation"]), position)
+
+
+def _check_length(question, options, correct, explanation, position):
+    # Длина — как её считает Telegram: после разбора разметки, без тегов и &lt;
+    feedback = _render_feedback(question, options, correct, explanation)
+    for name, length in (
+        ("текст вопроса", _text_length(_render_body(question, options))),
+        ("пояснение", _text_length(unescape(feedback.replace("<b>", "").replace("</b>", "")))),
+    ):
+        if length + HEADER_RESERVE > MAX_MESSAGE_LENGTH:
+            raise QuestionBankError(
+                f"Вопрос #{position}: {name} — {length} символов, "
+                f"допустимо не больше {MAX_MESSAGE_LENGTH - HEADER_RESERVE}"
+            )
+
+
+def compile_question(raw, position=0):
+    validate_question(raw, position)
+    return CompiledQuestion(
+        str(raw["question"]),
+        [str(option) for option in raw["options"]],
+        raw["correct"],
+        str(raw["explanation"]),
+    )
+
+
+def compile_bank(raw_questions):
+    bank = tuple(compile_question(raw, position) for position, raw in enumerate(raw_questions, start=1))
+    if not bank:
+        raise QuestionBankError("Банк вопросов пуст")
+    return bank
+
+
+def render_question(q, number, total):
+    return f"📝 Вопрос {number} из {total}:\n\n{q.body}"
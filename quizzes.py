@@ -0,0 +1,180 @@
+# quizzes.py — несколько тестов в одном боте
+# У каждого теста свой банк вопросов, длина, пороги уровней и тексты. Тест
+# выбирают ссылкой https://t.me/<бот>?start=<id> (то же, что /start <id>);
+# просто /start открывает первый тест. Список тестов — в QUIZZES_FILE (JSON),
+# без него бот работает с одним тестом, как раньше.
+#
+# Скомпилированные банки общие для всех сессий и только читаются (тесты с
+# одним файлом вопросов делят и банк). Сессия ссылается на тест номером —
+# старшим байтом поля версии банка (см. sessions.Session), поэтому новый тест
+# не добавляет памяти на пользователя. Номер — позиция теста в файле: новые
+# тесты дописывайте в конец, иначе начатые тесты и история перепутаются.
+#
+# Первый тест пишет рейтинг и журналы туда же, куда писал единственный тест;
+# остальные — в таблицу leaderboard_<id> и подкаталог <EVENTS_DIR>/<id>.
+#
+# Пример QUIZZES_FILE (пути к вопросам — относительно файла):
+#   [{"id": "negotiation", "title": "Тренажёр переговоров", "questions": "questions.py"},
+#    {"id": "product", "title": "Знание продукта", "questions": "product.jsonl", "length": 10,
+#     "levels": [[0.8, "🏅 Эксперт!"], [0.5, "📈 Уверенный уровень."], [0, "🌱 Повторите материалы."]]}]
+
+import json
+import os
+import re
+
+from bank_loader import BankHolder, load_bank, load_python_bank
+from events import EventLog
+from leaderboard import Leaderboard
+from share import LEVELS
+
+DEFAULT_LENGTH = 20
+DEFAULT_INTRO = "Отвечайте честно — и получите полезные пояснения."
+# Номер теста занимает байт в сессии
+MAX_QUIZZES = 255
+# id попадает в deep link, имя таблицы и каталога
+QUIZ_ID = re.compile(r"^[A-Za-z0-9_]{1,32}$")
+# История ответов по тесту хранится под ключом user_id + номер теста в старших
+# битах (user_id в Telegram — до 52 бит); у первого теста ключ — сам user_id
+HISTORY_SHIFT = 52
+
+
+class QuizConfigError(ValueError):
+    pass
+
+
+class Quiz:
+    __slots__ = ("id", "number", "title", "banks", "length", "levels", "intro", "events", "leaderboard")
+
+    def __init__(self, id, title, banks, length=DEFAULT_LENGTH, levels=LEVELS, intro=DEFAULT_INTRO):
+        self.id = id
+        self.number = 0  # выставляет QuizRegistry
+        self.title = title
+        self.banks = banks
+        self.length = length
+        self.levels = levels
+        self.intro = intro
+        # Журнал событий и рейтинг открывает QuizRegistry.open()
+        self.events = None
+        self.leaderboard = None
+
+    def history_key(self, user_id):
+        return user_id | (self.number << HISTORY_SHIFT)
+
+    def link(self, username):
+        # Ссылка на бота, открывающая этот тест
+        return f"https://t.me/{username}" if self.number == 0 else f"https://t.me/{username}?start={self.id}"
+
+
+class QuizRegistry:
+    def __init__(self, quizzes):
+        if not 0 < len(quizzes) <= MAX_QUIZZES:
+            raise QuizConfigError(f"Нужно от 1 до {MAX_QUIZZES} тестов")
+        self._list = list(quizzes)
+        self._by_id = {}
+        for number, quiz in enumerate(self._list):
+            if quiz.id in self._by_id:
+                raise QuizConfigError(f"Тест {quiz.id!r} указан дважды")
+            quiz.number = number
+            self._by_id[quiz.id] = quiz
+
+    @property
+    def default(self):
+        return self._list[0]
+
+    def __len__(self):
+        return len(self._list)
+
+    def __iter__(self):
+        return iter(self._list)
+
+    def get(self, quiz_id):
+        return self._by_id.get(quiz_id)
+
+    def by_number(self, number):
+        # Номер из сессии или кнопки; тесты только дописывают в конец, поэтому
+        # неизвестный номер — кнопка старше бота, а не чужой тест
+        return self._list[number] if 0 <= number < len(self._list) else self.default
+
+    def of(self, session):
+        return self.by_number(session.quiz)
+
+    def banks(self):
+        # Каждый банк один раз, даже если он общий у нескольких тестов
+        return list({id(quiz.banks): quiz.banks for quiz in self._list}.values())
+
+    def open(self, events_dir, events_name, leaderboard_path):
+        for quiz in self._list:
+            directory = events_dir if quiz.number == 0 else os.path.join(events_dir, quiz.id)
+            table = "leaderboard" if quiz.number == 0 else f"leaderboard_{quiz.id}"
+            quiz.events = EventLog(directory, name=events_name)
+            quiz.leaderboard = Leaderboard(leaderboard_path, table=table)
+
+    async def close(self):
+        for quiz in self._list:
+            await quiz.events.close()
+            quiz.leaderboard.close()
+
+
+# === Загрузка QUIZZES_FILE ===
+def _levels(raw, quiz_id):
+    if not isinstance(raw, list) or not raw:
+        raise QuizConfigError(f"Тест {quiz_id!r}: levels — непустой список [доля, текст]")
+    levels = []
+    for item in raw:
+        if (not isinstance(item, list) or len(item) != 2 or isinstance(item[0], bool)
+                or not isinstance(item[0], (int, float)) or not 0 <= item[0] <= 1
+                or not isinstance(item[1], str) or not item[1].strip()):
+            raise QuizConfigError(f"Тест {quiz_id!r}: уровень {item!r} — нужно [доля от 0 до 1, текст]")
+        levels.append((float(item[0]), item[1]))
+    # От высшего уровня к низшему: result_level берёт первый подходящий
+    return tuple(sorted(levels, key=lambda level: -level[0]))
+
+
+def _quiz_from_config(raw, load):
+    if not isinstance(raw, dict):
+        raise QuizConfigError(f"Тест {raw!r}: нужен объект")
+    quiz_id = raw.get("id")
+    if not isinstance(quiz_id, str) or not QUIZ_ID.match(quiz_id):
+        raise QuizConfigError(f"id {quiz_id!r}: латиница, цифры и _, до 32 символов")
+    title = raw.get("title")
+    if not isinstance(title, str) or not title.strip():
+        raise QuizConfigError(f"Тест {quiz_id!r}: нужен title")
+    questions = raw.get("questions")
+    if not isinstance(questions, str) or not questions:
+        raise QuizConfigError(f"Тест {quiz_id!r}: нужен путь questions")
+    length = raw.get("length", DEFAULT_LENGTH)
+    if isinstance(length, bool) or not isinstance(length, int) or not 0 < length <= 0xFFFF:
+        raise QuizConfigError(f"Тест {quiz_id!r}: length — целое число больше 0")
+    intro = raw.get("intro", DEFAULT_INTRO)
+    if not isinstance(intro, str):
+        raise QuizConfigError(f"Тест {quiz_id!r}: intro — строка")
+    levels = _levels(raw["levels"], quiz_id) if "levels" in raw else LEVELS
+    return Quiz(quiz_id, title, load(questions), length=length, levels=levels, intro=intro)
+
+
+def load_quizzes(path, lazy="auto", cache_dir=None):
+    with open(path, encoding="utf-8") as f:
+        try:
+            config = json.load(f)
+        except ValueError as e:
+            raise QuizConfigError(f"{path}: некорректный JSON ({e})") from e
+    if not isinstance(config, list):
+        raise QuizConfigError(f"{path}: нужен список тестов")
+
+    base = os.path.dirname(os.path.abspath(path))
+    holders = {}
+
+    def load(questions):
+        # Один файл вопросов — один банк в памяти на все тесты, которые его используют
+        questions = os.path.join(base, questions)
+        holder = holders.get(questions)
+        if holder is None:
+            if questions.endswith(".py"):
+                holder = BankHolder(load_python_bank(questions, cache_dir))
+            else:
+                holder = BankHolder(load_bank(questions, lazy, cache_dir), path=questions,
+                                    lazy=lazy, cache_dir=cache_dir)
+            holders[questions] = holder
+        return holder
+
+    return QuizRegistry([_quiz_from_config(raw, load) for raw in config])
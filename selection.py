@@ -0,0 +1,163 @@
+# selection.py — выбор вопросов для теста с учётом истории пользователя
+# История — два битовых поля по номерам вопросов (видел / ошибся) и список
+# ошибочных номеров. Выборка k вопросов без повторов стоит O(k) в среднем
+# (выборка с отбраковкой), а не O(размер банка).
+#
+# Режимы:
+#   unseen — сначала невиденные вопросы, затем те, где были ошибки, затем остальные
+#   review — работа над ошибками: сначала вопросы с ошибками, добор — невиденными
+
+import random
+import struct
+from array import array
+
+MODE_UNSEEN = "unseen"
+MODE_REVIEW = "review"
+
+
+def _test(bits, i):
+    byte = i >> 3
+    return byte < len(bits) and (bits[byte] >> (i & 7)) & 1
+
+
+def _set(bits, i):
+    byte = i >> 3
+    if byte >= len(bits):
+        bits.extend(bytes(byte + 1 - len(bits)))
+    bits[byte] |= 1 << (i & 7)
+
+
+def _clear(bits, i):
+    byte = i >> 3
+    if byte < len(bits):
+        bits[byte] &= ~(1 << (i & 7)) & 0xFF
+
+
+# === История пользователя ===
+class History:
+    __slots__ = ("seen", "seen_count", "wrong", "wrong_ids", "rev")
+
+    # seen_count, длина seen в байтах, число ошибочных вопросов
+    _header = struct.Struct("<III")
+
+    def __init__(self, seen=None, seen_count=0, wrong_ids=None):
+        self.seen = seen if seen is not None else bytearray()
+        self.seen_count = seen_count
+        self.wrong_ids = wrong_ids if wrong_ids is not None else array("I")
+        self.wrong = bytearray()
+        self.rev = 0  # ревизия в общем хранилище (см. sessions.py)
+        for i in self.wrong_ids:
+            _set(self.wrong, i)
+
+    def is_seen(self, i):
+        return _test(self.seen, i)
+
+    def is_wrong(self, i):
+        return _test(self.wrong, i)
+
+    def record(self, question_id, correct):
+        # Возвращает, ошибался ли пользователь в этом вопросе раньше
+        was_wrong = bool(_test(self.wrong, question_id))
+        if not _test(self.seen, question_id):
+            _set(self.seen, question_id)
+            self.seen_count += 1
+        if correct:
+            if _test(self.wrong, question_id):
+                # Ошибку исправили — убираем из работы над ошибками
+                _clear(self.wrong, question_id)
+                self.wrong_ids.remove(question_id)
+        elif not _test(self.wrong, question_id):
+            _set(self.wrong, question_id)
+            self.wrong_ids.append(question_id)
+        return was_wrong
+
+    def reset_seen(self):
+        self.seen = bytearray()
+        self.seen_count = 0
+
+    def to_bytes(self):
+        header = self._header.pack(self.seen_count, len(self.seen), len(self.wrong_ids))
+        return header + bytes(self.seen) + self.wrong_ids.tobytes()
+
+    @classmethod
+    def from_bytes(cls, raw):
+        seen_count, seen_len, wrong_len = cls._header.unpack_from(raw)
+        offset = cls._header.size
+        seen = bytearray(raw[offset:offset + seen_len])
+        wrong_ids = array("I")
+        wrong_ids.frombytes(raw[offset + seen_len:offset + seen_len + wrong_len * wrong_ids.itemsize])
+        return cls(seen, seen_count, wrong_ids)
+
+
+# === Выборка ===
+class QuestionSelector:
+    def __init__(self, store, rng=None):
+        # store — хранилище с интерфейсом SessionStore (user_id -> History)
+        self.store = store
+        self.rng = rng or random.Random()
+
+    def history(self, user_id):
+        history = self.store.get(user_id)
+        if history is None:
+            history = History()
+        return history
+
+    def record(self, user_id, question_id, correct):
+        history = self.history(user_id)
+        was_wrong = history.record(question_id, correct)
+        self.store.put(user_id, history)
+        return was_wrong
+
+    def select(self, user_id, bank_size, k, mode=MODE_UNSEEN):
+        k = min(k, bank_size)
+        history = self.history(user_id)
+        chosen = []
+        taken = set()
+
+        if mode == MODE_REVIEW:
+            self._take_wrong(history, bank_size, k, chosen, taken)
+        self._take_unseen(history, bank_size, k, chosen, taken)
+        if mode != MODE_REVIEW:
+            self._take_wrong(history, bank_size, k, chosen, taken)
+        self._take_any(bank_size, k, chosen, taken)
+
+        self.store.put(user_id, history)
+        self.rng.shuffle(chosen)
+        return chosen
+
+    def _take_wrong(self, history, bank_size, k, chosen, taken):
+        need = k - len(chosen)
+        candidates = [i for i in history.wrong_ids if i < bank_size and i not in taken]
+        for i in self.rng.sample(candidates, min(need, len(candidates))):
+            chosen.append(i)
+            taken.add(i)
+
+    def _take_unseen(self, history, bank_size, k, chosen, taken):
+        need = k - len(chosen)
+        if need <= 0:
+            return
+        unseen = bank_size - min(history.seen_count, bank_size)
+        if unseen >= 4 * need:
+            # Невиденных много — отбраковка почти всегда попадает с первого раза
+            for _ in range(16 * need):
+                i = self.rng.randrange(bank_size)
+                if i not in taken and not history.is_seen(i):
+                    chosen.append(i)
+                    taken.add(i)
+                    if len(chosen) == k:
+                        return
+        # Невиденных мало — один проход по битовому полю
+        candidates = [i for i in range(bank_size) if i not in taken and not history.is_seen(i)]
+        for i in self.rng.sample(candidates, min(k - len(chosen), len(candidates))):
+            chosen.append(i)
+            taken.add(i)
+        if len(chosen) < k:
+            # Пользователь видел весь банк — начинаем новый круг
+            history.reset_seen()
+
+    def _take_any(self, bank_size, k, chosen, taken):
+        while len(chosen) < k:
+            i = self.rng.randrange(bank_size)
+            if i not in taken:
+                chosen.append(i)
+                taken.add(i)
@@ -0,0 +1,676 @@
+# sessions.py — хранилище сессий пользователей
+# Бэкенды с одинаковым интерфейсом:
+#   MemorySessionStore — ограниченный LRU со временем жизни (TTL)
+#   SqliteSessionStore — SQLite в режиме WAL с пакетной записью, переживает перезапуск
+#   SharedSqliteSessionStore — общий SQLite для нескольких процессов на одной машине
+#   RedisSessionStore — Redis (или совместимый сервер) для нескольких машин;
+#   с REDIS_URL=memory:// — LocalRedis, замена Redis в памяти процесса для тестов
+# Память при остановке сохраняется в снимок (save_snapshot) и читается при
+# следующем запуске (load_snapshot), чтобы перезапуск не обрывал начатые тесты.
+# Общие хранилища меняют сессию атомарно через compare_and_set: запись проходит,
+# только если с момента чтения сессию никто не менял.
+
+import asyncio
+import os
+import random
+import sqlite3
+import struct
+import time
+from array import array
+from collections import OrderedDict
+
+
+# === Компактная сессия: номера вопросов в банке + счётчики ===
+class Session:
+    __slots__ = ("question_ids", "index", "correct_count", "start_time", "answered", "bank_version",
+                 "shown_at", "quiz", "rev")
+
+    # typecode, index, correct_count, start_time, answered, quiz << 24 | bank_version, shown_at
+    _header = struct.Struct("<cHHd?Id")
+
+    def __init__(self, question_ids, index=0, correct_count=0, start_time=0.0, answered=False,
+                 bank_version=1, shown_at=None, quiz=0):
+        self.question_ids = question_ids
+        self.index = index
+        self.correct_count = correct_count
+        self.start_time = start_time
+        self.answered = answered
+        # Версия банка, из которого выбраны вопросы (см. bank_loader.BankHolder)
+        self.bank_version = bank_version
+        # Когда показан текущий вопрос — для времени ответа
+        self.shown_at = start_time if shown_at is None else shown_at
+        # Номер теста (см. quizzes.py); в записи — старший байт поля версии банка,
+        # поэтому записи, сделанные до появления тестов, читаются как тест 0
+        self.quiz = quiz
+        # Ревизия записи в общем хранилище (не сериализуется, выставляется при чтении)
+        self.rev = 0
+
+    @classmethod
+    def new(cls, question_ids, bank_size, start_time, bank_version=1, quiz=0):
+        # 'H' хватает на банк до 65535 вопросов — 2 байта на вопрос
+        typecode = "H" if bank_size <= 0xFFFF else "I"
+        return cls(array(typecode, question_ids), start_time=start_time, bank_version=bank_version, quiz=quiz)
+
+    @property
+    def total(self):
+        return len(self.question_ids)
+
+    @property
+    def finished(self):
+        return self.index >= len(self.question_ids)
+
+    @property
+    def question_id(self):
+        return self.question_ids[self.index]
+
+    @property
+    def nonce(self):
+        # Байт, отличающий тест от прошлых тестов пользователя; из start_time,
+        # поэтому переживает перезапуск без изменения формата
+        return int(self.start_time * 1000) & 0xFF
+
+    @property
+    def tag(self):
+        # Метка текущего вопроса для callback_data
+        return f"{self.nonce}_{self.index}"
+
+    def to_bytes(self):
+        header = self._header.pack(
+            self.question_ids.typecode.encode(),
+            self.index,
+            self.correct_count,
+            self.start_time,
+            self.answered,
+            # Версий банка за время жизни процесса меньше 2**24
+            self.quiz << 24 | self.bank_version & 0xFFFFFF,
+            self.shown_at,
+        )
+        return header + self.question_ids.tobytes()
+
+    @classmethod
+    def from_bytes(cls, raw):
+        (typecode, index, correct_count, start_time, answered, version,
+         shown_at) = cls._header.unpack_from(raw)
+        question_ids = array(typecode.decode())
+        question_ids.frombytes(raw[cls._header.size:])
+        return cls(question_ids, index, correct_count, start_time, answered, version & 0xFFFFFF, shown_at,
+                   quiz=version >> 24)
+
+
+class SessionStore:
+    def get(self, user_id):
+        raise NotImplementedError
+
+    def put(self, user_id, session):
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def active(self, window):
+        # Сколько сессий было активно за последние window секунд
+        raise NotImplementedError
+
+    def compare_and_set(self, user_id, session):
+        # Записать, только если сессию не меняли после get(). В одном процессе
+        # обновления пользователя и так идут по очереди — пишем без проверки
+        self.put(user_id, session)
+        return True
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def flush(self):
+        pass
+
+    async def watch(self):
+        # Фоновая работа хранилища (запускает bot.serve); у большинства её нет
+        pass
+
+    def close(self):
+        self.flush()
+
+
+# === В памяти: LRU + TTL ===
+class MemorySessionStore(SessionStore):
+    def __init__(self, max_size=10000, ttl=6 * 3600, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        # user_id -> (session, время последнего обращения); порядок = порядок обращений
+        self._items = OrderedDict()
+
+    def get(self, user_id):
+        item = self._items.get(user_id)
+        if item is None:
+            return None
+        session, touched = item
+        now = self._clock()
+        if now - touched > self.ttl:
+            del self._items[user_id]
+            return None
+        self._items[user_id] = (session, now)
+        self._items.move_to_end(user_id)
+        return session
+
+    def put(self, user_id, session):
+        self._items[user_id] = (session, self._clock())
+        self._items.move_to_end(user_id)
+        self.evict()
+
+    def delete(self, user_id):
+        self._items.pop(user_id, None)
+
+    def evict(self):
+        # Самые старые записи всегда в начале — проверка дешёвая
+        deadline = self._clock() - self.ttl
+        items = self._items
+        while items:
+            user_id, (_, touched) = next(iter(items.items()))
+            if len(items) <= self.max_size and touched >= deadline:
+                break
+            del items[user_id]
+
+    def __len__(self):
+        return len(self._items)
+
+    def active(self, window):
+        # Свежие записи в конце — идём с конца, пока не встретим старую
+        deadline = self._clock() - window
+        count = 0
+        for _, touched in reversed(self._items.values()):
+            if touched < deadline:
+                break
+            count += 1
+        return count
+
+    # --- Снимок на время перезапуска ---
+    # Заголовок: метка, время записи, число записей; запись: user_id, сколько
+    # секунд назад было обращение, длина данных, данные
+    _snapshot_header = struct.Struct("<4sdI")
+    _snapshot_record = struct.Struct("<qdI")
+    _snapshot_magic = b"QSS1"
+
+    def save_snapshot(self, path, encode=Session.to_bytes):
+        self.evict()
+        now = self._clock()
+        chunks = [self._snapshot_header.pack(self._snapshot_magic, time.time(), len(self._items))]
+        # Порядок записей — порядок LRU, от самых старых к свежим
+        for user_id, (session, touched) in self._items.items():
+            raw = encode(session)
+            chunks.append(self._snapshot_record.pack(user_id, now - touched, len(raw)))
+            chunks.append(raw)
+        with open(path + ".tmp", "wb") as f:
+            f.write(b"".join(chunks))
+        os.replace(path + ".tmp", path)
+        return len(self._items)
+
+    def load_snapshot(self, path, decode=Session.from_bytes):
+        # Возвращает user_id восстановленных записей; время простоя идёт в счёт TTL
+        with open(path, "rb") as f:
+            raw = f.read()
+        magic, saved_at, count = self._snapshot_header.unpack_from(raw)
+        if magic != self._snapshot_magic:
+            raise ValueError(f"{path}: не снимок сессий")
+        downtime = max(0.0, time.time() - saved_at)
+        now = self._clock()
+        offset = self._snapshot_header.size
+        restored = []
+        for _ in range(count):
+            user_id, age, size = self._snapshot_record.unpack_from(raw, offset)
+            offset += self._snapshot_record.size
+            data = raw[offset:offset + size]
+            offset += size
+            age += downtime
+            if age > self.ttl or user_id in self._items:
+                continue
+            self._items[user_id] = (decode(data), now - age)
+            restored.append(user_id)
+        self.evict()
+        return [user_id for user_id in restored if user_id in self._items]
+
+
+# === SQLite: WAL + пакетная запись ===
+class SqliteSessionStore(SessionStore):
+    def __init__(self, path, encode=Session.to_bytes, decode=Session.from_bytes, ttl=6 * 3600,
+                 batch_size=100, flush_interval=1.0, cache_size=10000, clock=time.time,
+                 table="sessions"):
+        # В одном файле может жить несколько хранилищ — каждое в своей таблице
+        self.table = table
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._encode = encode
+        self._decode = decode
+        self._clock = clock
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            " user_id INTEGER PRIMARY KEY,"
+            " data BLOB NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._db.execute(f"CREATE INDEX IF NOT EXISTS {table}_updated ON {table}(updated_at)")
+        self._db.commit()
+        # Горячие сессии держим в памяти, чтобы не читать БД на каждое нажатие
+        self._cache = MemorySessionStore(max_size=cache_size, ttl=ttl, clock=clock)
+        # user_id -> сессия (None — удаление), ещё не записанные в БД
+        self._pending = {}
+        self._last_flush = clock()
+
+    def get(self, user_id):
+        if user_id in self._pending:
+            session = self._pending[user_id]
+            if session is not None:
+                self._cache.put(user_id, session)
+            return session
+        session = self._cache.get(user_id)
+        if session is not None:
+            return session
+        row = self._db.execute(
+            f"SELECT data FROM {self.table} WHERE user_id = ? AND updated_at >= ?",
+            (user_id, self._clock() - self.ttl),
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            session = self._decode(row[0])
+        except (ValueError, struct.error):
+            # Запись в старом формате — считаем, что сессии нет
+            return None
+        self._cache.put(user_id, session)
+        return session
+
+    def put(self, user_id, session):
+        self._cache.put(user_id, session)
+        self._pending[user_id] = session
+        self._maybe_flush()
+
+    def delete(self, user_id):
+        self._cache.delete(user_id)
+        self._pending[user_id] = None
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if (len(self._pending) >= self.batch_size
+                or self._clock() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    async def watch(self):
+        # put() пишет пачку, только если с прошлой записи прошло flush_interval, —
+        # без этого таймера последняя запись перед затишьем ждала бы следующего
+        # нажатия и пропала бы при падении процесса
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._pending:
+                self.flush()
+
+    def flush(self):
+        now = self._clock()
+        pending, self._pending = self._pending, {}
+        upserts = [(user_id, self._encode(s), now) for user_id, s in pending.items() if s is not None]
+        deletes = [(user_id,) for user_id, s in pending.items() if s is None]
+        with self._db:
+            if upserts:
+                self._db.executemany(
+                    f"INSERT INTO {self.table} (user_id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    upserts,
+                )
+            if deletes:
+                self._db.executemany(f"DELETE FROM {self.table} WHERE user_id = ?", deletes)
+            # Брошенные сессии удаляются заодно с очередной пачкой
+            self._db.execute(f"DELETE FROM {self.table} WHERE updated_at < ?", (now - self.ttl,))
+        self._last_flush = now
+
+    def __len__(self):
+        self.flush()
+        return self._db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def active(self, window):
+        self.flush()
+        return self._db.execute(
+            f"SELECT COUNT(*) FROM {self.table} WHERE updated_at >= ?", (self._clock() - window,)
+        ).fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+
+def _new_rev():
+    # Случайная ревизия, а не счётчик: после удаления и создания сессии заново
+    # старая прочитанная копия не совпадёт с новой (нет проблемы ABA)
+    return random.getrandbits(62) + 1
+
+
+# === Общий SQLite: несколько процессов, атомарные переходы ===
+class SharedSqliteSessionStore(SessionStore):
+    # Без кэша и пакетной записи: сессию в любой момент может поменять другой процесс.
+    # Запись идёт прямо в event loop и занимает доли миллисекунды; busy_timeout —
+    # сколько ждать чужую транзакцию. Дольше не ждём: это стояли бы все
+    # пользователи воркера, а не один (sqlite3.OperationalError уйдёт в on_error)
+    def __init__(self, path, encode=Session.to_bytes, decode=Session.from_bytes, ttl=6 * 3600,
+                 purge_interval=60.0, clock=time.time, table="shared_sessions", busy_timeout=0.5):
+        self.table = table
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._encode = encode
+        self._decode = decode
+        self._clock = clock
+        # Автокоммит: каждая запись — отдельная короткая транзакция
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=busy_timeout)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            " user_id INTEGER PRIMARY KEY,"
+            " data BLOB NOT NULL,"
+            " rev INTEGER NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._db.execute(f"CREATE INDEX IF NOT EXISTS {table}_updated ON {table}(updated_at)")
+        self._last_purge = clock()
+
+    def get(self, user_id):
+        row = self._db.execute(
+            f"SELECT data, rev FROM {self.table} WHERE user_id = ? AND updated_at >= ?",
+            (user_id, self._clock() - self.ttl),
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            session = self._decode(row[0])
+        except (ValueError, struct.error):
+            return None
+        session.rev = row[1]
+        return session
+
+    def put(self, user_id, session):
+        rev = _new_rev()
+        self._db.execute(
+            f"INSERT INTO {self.table} (user_id, data, rev, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET"
+            " data = excluded.data, rev = excluded.rev, updated_at = excluded.updated_at",
+            (user_id, self._encode(session), rev, self._clock()),
+        )
+        session.rev = rev
+        self._maybe_purge()
+
+    def compare_and_set(self, user_id, session):
+        rev = _new_rev()
+        cursor = self._db.execute(
+            f"UPDATE {self.table} SET data = ?, rev = ?, updated_at = ? WHERE user_id = ? AND rev = ?",
+            (self._encode(session), rev, self._clock(), user_id, session.rev),
+        )
+        if cursor.rowcount != 1:
+            return False
+        session.rev = rev
+        return True
+
+    def delete(self, user_id):
+        self._db.execute(f"DELETE FROM {self.table} WHERE user_id = ?", (user_id,))
+
+    def _maybe_purge(self):
+        now = self._clock()
+        if now - self._last_purge >= self.purge_interval:
+            self._last_purge = now
+            self._db.execute(f"DELETE FROM {self.table} WHERE updated_at < ?", (now - self.ttl,))
+
+    def __len__(self):
+        return self._db.execute(
+            f"SELECT COUNT(*) FROM {self.table} WHERE updated_at >= ?", (self._clock() - self.ttl,)
+        ).fetchone()[0]
+
+    def active(self, window):
+        return self._db.execute(
+            f"SELECT COUNT(*) FROM {self.table} WHERE updated_at >= ?", (self._clock() - window,)
+        ).fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+# === Redis: несколько машин ===
+# Сессия — хеш {data, rev} с TTL; время активности — в отсортированном множестве
+# <prefix>active (для len() и active()). compare_and_set — один Lua-скрипт,
+# то есть один сетевой запрос.
+_CAS_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'rev') ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'data', ARGV[2], 'rev', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('ZADD', KEYS[2], ARGV[5], ARGV[6])
+return 1
+"""
+
+
+class RedisSessionStore(SessionStore):
+    def __init__(self, url, encode=Session.to_bytes, decode=Session.from_bytes, ttl=6 * 3600,
+                 prefix="session:", clock=time.time):
+        self.ttl = ttl
+        self.prefix = prefix
+        self._encode = encode
+        self._decode = decode
+        self._clock = clock
+        if url.startswith(LocalRedis.SCHEME):
+            self._redis = LocalRedis.from_url(url)
+        else:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("Для хранилища Redis установите пакет redis: pip install redis") from None
+            self._redis = redis.Redis.from_url(url)
+        self._cas = self._redis.register_script(_CAS_SCRIPT)
+        self._active_key = prefix + "active"
+
+    def _key(self, user_id):
+        return f"{self.prefix}{user_id}"
+
+    def get(self, user_id):
+        data, rev = self._redis.hmget(self._key(user_id), "data", "rev")
+        if data is None or rev is None:
+            return None
+        try:
+            session = self._decode(data)
+        except (ValueError, struct.error):
+            return None
+        session.rev = int(rev)
+        return session
+
+    def put(self, user_id, session):
+        key = self._key(user_id)
+        rev = _new_rev()
+        pipe = self._redis.pipeline()
+        pipe.hset(key, mapping={"data": self._encode(session), "rev": rev})
+        pipe.expire(key, self.ttl)
+        pipe.zadd(self._active_key, {user_id: self._clock()})
+        pipe.execute()
+        session.rev = rev
+
+    def compare_and_set(self, user_id, session):
+        rev = _new_rev()
+        ok = self._cas(
+            keys=[self._key(user_id), self._active_key],
+            args=[session.rev, self._encode(session), rev, self.ttl, self._clock(), user_id],
+        )
+        if not ok:
+            return False
+        session.rev = rev
+        return True
+
+    def delete(self, user_id):
+        pipe = self._redis.pipeline()
+        pipe.delete(self._key(user_id))
+        pipe.zrem(self._active_key, user_id)
+        pipe.execute()
+
+    def __len__(self):
+        pipe = self._redis.pipeline()
+        pipe.zremrangebyscore(self._active_key, "-inf", self._clock() - self.ttl)
+        pipe.zcard(self._active_key)
+        return pipe.execute()[1]
+
+    def active(self, window):
+        return self._redis.zcount(self._active_key, self._clock() - window, "+inf")
+
+    def close(self):
+        self._redis.close()
+
+
+# === Замена Redis в памяти процесса ===
+# Те же команды и ответы (bytes), что RedisSessionStore получает от redis-py,
+# и тот же compare_and_set, только скрипт выполняется на Python. Клиенты с
+# одним URL (memory://<имя>) видят общие данные — как два процесса один сервер.
+# Для тестов и запуска одного процесса без Redis; между процессами не работает.
+def _encode_value(value):
+    # Как redis-py: числа и строки хранятся байтами
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    return repr(value).encode() if isinstance(value, float) else str(value).encode()
+
+
+class LocalRedis:
+    SCHEME = "memory://"
+    _servers = {}  # URL -> (данные, сроки жизни ключей)
+
+    def __init__(self, server=None, clock=time.time):
+        self._data, self._expires = server if server is not None else ({}, {})
+        self._clock = clock
+
+    @classmethod
+    def from_url(cls, url):
+        return cls(cls._servers.setdefault(url, ({}, {})))
+
+    def _get(self, key, kind):
+        key = _encode_value(key)
+        deadline = self._expires.get(key)
+        if deadline is not None and deadline <= self._clock():
+            del self._data[key], self._expires[key]
+        value = self._data.get(key)
+        if value is not None and not isinstance(value, kind):
+            raise TypeError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _create(self, key, kind):
+        value = self._get(key, kind)
+        if value is None:
+            value = self._data[_encode_value(key)] = kind()
+        return value
+
+    # --- Хеши ---
+    def hset(self, key, field=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        hash_ = self._create(key, dict)
+        added = 0
+        for name, item in items.items():
+            name = _encode_value(name)
+            added += name not in hash_
+            hash_[name] = _encode_value(item)
+        return added
+
+    def hmget(self, key, *fields):
+        hash_ = self._get(key, dict) or {}
+        return [hash_.get(_encode_value(name)) for name in fields]
+
+    # --- Ключи ---
+    def expire(self, key, seconds):
+        if self._get(key, object) is None:
+            return False
+        self._expires[_encode_value(key)] = self._clock() + float(seconds)
+        return True
+
+    def delete(self, *keys):
+        deleted = 0
+        for key in keys:
+            if self._get(key, object) is not None:
+                key = _encode_value(key)
+                del self._data[key]
+                self._expires.pop(key, None)
+                deleted += 1
+        return deleted
+
+    # --- Отсортированные множества: член -> score ---
+    def zadd(self, key, mapping):
+        zset = self._create(key, _ZSet)
+        added = 0
+        for member, score in mapping.items():
+            member = _encode_value(member)
+            added += member not in zset
+            zset[member] = float(score)
+        return added
+
+    def zrem(self, key, *members):
+        zset = self._get(key, _ZSet) or {}
+        return sum(zset.pop(_encode_value(member), None) is not None for member in members)
+
+    def zcard(self, key):
+        return len(self._get(key, _ZSet) or ())
+
+    def zcount(self, key, low, high):
+        low, high = float(low), float(high)
+        return sum(low <= score <= high for score in (self._get(key, _ZSet) or {}).values())
+
+    def zremrangebyscore(self, key, low, high):
+        zset = self._get(key, _ZSet) or {}
+        low, high = float(low), float(high)
+        removed = [member for member, score in zset.items() if low <= score <= high]
+        for member in removed:
+            del zset[member]
+        return len(removed)
+
+    # --- Пакеты и скрипты ---
+    def pipeline(self):
+        return _LocalPipeline(self)
+
+    def register_script(self, script):
+        if script != _CAS_SCRIPT:
+            raise NotImplementedError("LocalRedis выполняет только скрипт compare_and_set из sessions.py")
+        return self._compare_and_set
+
+    def _compare_and_set(self, keys, args):
+        key, active_key = keys
+        rev, data, new_rev, ttl, score, member = args
+        hash_ = self._get(key, dict)
+        if hash_ is None or hash_.get(b"rev") != _encode_value(rev):
+            return 0
+        self.hset(key, mapping={"data": data, "rev": new_rev})
+        self.expire(key, ttl)
+        self.zadd(active_key, {member: score})
+        return 1
+
+    def close(self):
+        pass
+
+
+class _ZSet(dict):
+    pass
+
+
+class _LocalPipeline:
+    # Команды копятся и выполняются разом — в одном потоке это и так атомарно
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        return [method(*args, **kwargs) for method, args, kwargs in commands]
@@ -0,0 +1,126 @@
+# share.py — карточки результата для инлайн-режима (кнопка «Поделиться»)
+# Кнопка в итогах открывает «@бот Я набрал 15/20 ... #product» в любом чате; бот
+# отвечает готовой карточкой. Карточка зависит только от теста и счёта (и места
+# в рейтинге), поэтому собирается один раз и берётся из LRU, а повторные запросы
+# гасит кэш Telegram (cache_time). Инлайн-режим нужно включить у @BotFather (/setinline).
+# quiz — тест из quizzes.py; без #id в запросе карточка про первый тест.
+
+import re
+from collections import OrderedDict
+
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+)
+
+CACHE_SIZE = 1024
+# Счёт в тексте запроса: "15/20"; больше вопросов в тесте не бывает
+SCORE = re.compile(r"(\d{1,3})\s*/\s*(\d{1,3})")
+MAX_TOTAL = 100
+QUIZ_TAG = re.compile(r"#(\w+)")
+
+# Уровни по доле правильных ответов: (нижняя граница, текст), от высшего к низшему
+LEVELS = (
+    (0.9, "🏅 Профессионал! Вы отлично чувствуете клиента."),
+    (0.7, "📈 Хороший уровень. Есть над чем поработать."),
+    (0.0, "🌱 Начинающий. Повторите ключевые принципы коммуникации."),
+)
+
+
+def result_level(correct, total, levels=LEVELS):
+    for share, text in levels:
+        if correct >= total * share:
+            return text
+    return levels[-1][1]
+
+
+def share_query(quiz, correct, total):
+    # Текст кнопки «Поделиться»: его же бот получит в инлайн-запросе
+    tag = f" #{quiz.id}" if quiz.number else ""
+    return f"Я набрал {correct}/{total} в тесте «{quiz.title}»{tag}"
+
+
+def parse_quiz_id(query):
+    # Метка теста дописана в конец — берём последнюю
+    tags = QUIZ_TAG.findall(query)
+    return tags[-1] if tags else None
+
+
+def parse_score(query):
+    match = SCORE.search(query)
+    if match is None:
+        return None
+    correct, total = int(match.group(1)), int(match.group(2))
+    if not 0 <= correct <= total <= MAX_TOTAL or total == 0:
+        return None
+    return correct, total
+
+
+class ShareCards:
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._cards = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, key, build):
+        card = self._cards.get(key)
+        if card is None:
+            self.misses += 1
+            card = self._cards[key] = build()
+            if len(self._cards) > self.size:
+                self._cards.popitem(last=False)
+        else:
+            self.hits += 1
+            self._cards.move_to_end(key)
+        return card
+
+    def score(self, username, quiz, correct, total):
+        # Результат последнего теста — из текста кнопки «Поделиться»
+        level = result_level(correct, total, quiz.levels)
+        return self._cached(("score", username, quiz.id, correct, total), lambda: _card(
+            f"score-{quiz.id}-{correct}-{total}",
+            f"Мой результат: {correct} из {total}",
+            level,
+            f"✅ Мой результат: {correct} из {total}\n{level}",
+            username,
+            quiz,
+        ))
+
+    def best(self, username, quiz, correct, total, rank):
+        # Лучший результат из рейтинга — карточка общая для всех с тем же счётом и местом
+        level = result_level(correct, total, quiz.levels)
+        return self._cached(("best", username, quiz.id, correct, total, rank), lambda: _card(
+            f"best-{quiz.id}-{correct}-{total}-{rank}",
+            f"Лучший результат: {correct} из {total}, {rank}-е место",
+            level,
+            f"🏆 Мой лучший результат: {correct} из {total}\n"
+            f"Место в рейтинге: {rank}\n{level}",
+            username,
+            quiz,
+        ))
+
+    def invite(self, username, quiz):
+        return self._cached(("invite", username, quiz.id), lambda: _card(
+            f"invite-{quiz.id}",
+            f"Пригласить: {quiz.title}",
+            f"{quiz.length} вопросов с пояснениями",
+            f"Проверьте себя: {quiz.length} вопросов с пояснениями.",
+            username,
+            quiz,
+        ))
+
+    def stats(self):
+        return {"size": len(self._cards), "hits": self.hits, "misses": self.misses}
+
+
+def _card(result_id, title, description, text, username, quiz):
+    return InlineQueryResultArticle(
+        id=result_id,
+        title=title,
+        description=description,
+        input_message_content=InputTextMessageContent(f"🎯 {quiz.title}\n\n{text}\n\nПопробуйте сами 👇"),
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🚀 Пройти тест", url=quiz.link(username))]]),
+    )
@@ -0,0 +1,33 @@
+# startup.py — замеры времени запуска
+# Фазы отсчитываются от старта процесса, а не от импорта bot.py: после
+# пробуждения инстанса пользователь ждёт и запуск интерпретатора тоже.
+
+import os
+import time
+
+
+def _process_age():
+    # Сколько секунд назад стартовал процесс (Linux); где /proc нет — 0
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+_origin = time.perf_counter() - _process_age()
+
+# фаза -> секунд от старта процесса, в порядке прохождения
+phases = {}
+
+
+def mark(phase):
+    if phase not in phases:
+        phases[phase] = time.perf_counter() - _origin
+
+
+def report():
+    return ", ".join(f"{phase} {seconds:.2f} с" for phase, seconds in phases.items())
@@ -0,0 +1,66 @@
+# Выгрузка рейтинга по частям: каждую часть read_part читает в потоке пула
+# (как send_export и HTTP-маршрут), и потоки у частей могут быть разные.
+# Запуск: python -m pytest tests
+
+import asyncio
+import csv
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import export
+from export import iter_leaderboard, read_part
+from leaderboard import Leaderboard
+
+ROWS = 20000
+
+
+def _leaderboard(tmp_path):
+    board = Leaderboard(str(tmp_path / "leaderboard.db"), batch_size=ROWS)
+    for user_id in range(ROWS):
+        board.add(user_id, f"user{user_id}", user_id % 20, 20, 60.0 + user_id % 7)
+    board.flush()
+    return board
+
+
+def test_leaderboard_export_in_parts_across_threads(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "CHUNK_SIZE", 4096)
+    board = _leaderboard(tmp_path)
+    chunks = export._csv_chunks(export.COLUMNS["leaderboard"], iter_leaderboard(board.path))
+
+    async def read_all():
+        # Пул побольше и потоки по кругу — части заведомо читают разные потоки
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=4))
+        parts = []
+        try:
+            while True:
+                part = await asyncio.to_thread(read_part, chunks, 100000)
+                if not part:
+                    return parts
+                parts.append(part)
+        finally:
+            # Как в send_export: генератор закрывают в потоке цикла событий
+            chunks.close()
+
+    parts = asyncio.run(read_all())
+    board.close()
+    assert len(parts) > 1
+    rows = list(csv.reader(io.StringIO(b"".join(parts).decode("utf-8"))))
+    assert rows[0] == list(export.COLUMNS["leaderboard"])
+    assert len(rows) == ROWS + 1
+    assert len({row[0] for row in rows[1:]}) == ROWS
+
+
+def test_leaderboard_export_closed_early_from_other_thread(tmp_path):
+    board = _leaderboard(tmp_path)
+    rows = iter_leaderboard(board.path)
+    chunks = export._jsonl_chunks(export.COLUMNS["leaderboard"], rows)
+
+    async def first_part():
+        return await asyncio.to_thread(read_part, chunks, 1)
+
+    assert asyncio.run(first_part())
+    # Выгрузку прервали: закрытие из другого потока не падает
+    chunks.close()
+    rows.close()
+    board.close()
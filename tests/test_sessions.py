@@ -0,0 +1,137 @@
+# Общие хранилища сессий: атомарный compare_and_set между «процессами»
+# (два экземпляра хранилища над одними данными). Redis проверяется через
+# LocalRedis: тот же RedisSessionStore и те же команды.
+# Запуск: python -m pytest tests
+
+import asyncio
+import itertools
+from array import array
+
+import pytest
+
+from selection import History
+from sessions import LocalRedis, RedisSessionStore, Session, SharedSqliteSessionStore, SqliteSessionStore
+
+_names = itertools.count()
+
+
+def _session(start_time=1000.0):
+    return Session.new([3, 1, 4], bank_size=10, start_time=start_time)
+
+
+@pytest.fixture(params=["redis", "shared"])
+def stores(request, tmp_path):
+    # Два независимых клиента одного хранилища — как два воркера
+    if request.param == "redis":
+        url = f"{LocalRedis.SCHEME}test-{next(_names)}"
+        return RedisSessionStore(url), RedisSessionStore(url)
+    path = str(tmp_path / "sessions.db")
+    return SharedSqliteSessionStore(path), SharedSqliteSessionStore(path)
+
+
+def test_roundtrip(stores):
+    first, second = stores
+    first.put(1, _session())
+    session = second.get(1)
+    assert list(session.question_ids) == [3, 1, 4]
+    assert session.start_time == 1000.0
+    assert 1 in second and 2 not in second
+    assert len(second) == 1
+
+
+def test_compare_and_set_detects_concurrent_write(stores):
+    first, second = stores
+    first.put(1, _session())
+    mine, theirs = first.get(1), second.get(1)
+
+    theirs.index = 1
+    assert second.compare_and_set(1, theirs)
+    # Моя копия прочитана до чужой записи — переход отклонён
+    mine.correct_count = 1
+    assert not first.compare_and_set(1, mine)
+    assert first.get(1).index == 1 and first.get(1).correct_count == 0
+
+    # Перечитали — пишется
+    mine = first.get(1)
+    mine.index = 2
+    assert first.compare_and_set(1, mine)
+    assert second.get(1).index == 2
+
+
+def test_compare_and_set_after_restart_of_quiz(stores):
+    # Тест начали заново (delete + put): копия старого теста не должна записаться
+    first, second = stores
+    first.put(1, _session())
+    stale = second.get(1)
+    first.delete(1)
+    first.put(1, _session(start_time=2000.0))
+    stale.index = 1
+    assert not second.compare_and_set(1, stale)
+    assert first.get(1).start_time == 2000.0
+
+
+def test_compare_and_set_of_deleted_session(stores):
+    first, second = stores
+    first.put(1, _session())
+    stale = second.get(1)
+    first.delete(1)
+    assert not second.compare_and_set(1, stale)
+    assert first.get(1) is None
+    assert len(first) == 0
+
+
+def test_only_one_of_racing_writers_wins(stores):
+    first, second = stores
+    first.put(1, _session())
+    copies = [first.get(1), second.get(1), first.get(1)]
+    results = [store.compare_and_set(1, copy) for store, copy in zip((first, second, first), copies)]
+    assert results == [True, False, False]
+
+
+def test_redis_history_and_activity():
+    url = f"{LocalRedis.SCHEME}test-{next(_names)}"
+    clock = [1000.0]
+    sessions = RedisSessionStore(url, clock=lambda: clock[0])
+    history = RedisSessionStore(url, encode=History.to_bytes, decode=History.from_bytes, prefix="history:")
+    sessions.put(1, _session())
+    history.put(1, History(wrong_ids=array("I", [5])))
+    assert list(history.get(1).wrong_ids) == [5]
+    assert sessions.get(1) is not None
+
+    clock[0] += 600
+    sessions.put(2, _session())
+    assert sessions.active(300) == 1
+    assert len(sessions) == 2
+
+
+def test_local_redis_expires_keys():
+    now = [0.0]
+    client = LocalRedis(clock=lambda: now[0])
+    client.hset("k", mapping={"data": b"x", "rev": 7})
+    client.expire("k", 10)
+    assert client.hmget("k", "data", "rev") == [b"x", b"7"]
+    now[0] = 10.0
+    assert client.hmget("k", "data", "rev") == [None, None]
+
+
+def test_sqlite_writes_last_batch_without_new_puts(tmp_path):
+    # Пакетная запись: последняя сессия перед затишьем попадает в БД по таймеру,
+    # а не со следующим put()
+    path = str(tmp_path / "sessions.db")
+    store = SqliteSessionStore(path, flush_interval=0.05)
+
+    async def quiet_period():
+        watch = asyncio.create_task(store.watch())
+        store.put(1, _session())
+        store.flush()
+        store.put(2, _session())
+        assert SqliteSessionStore(path).get(2) is None
+        await asyncio.sleep(0.2)
+        watch.cancel()
+
+    asyncio.run(quiet_period())
+    # Другой процесс видит обе сессии, хотя close() ещё не вызывали
+    other = SqliteSessionStore(path)
+    assert other.get(1) is not None and other.get(2) is not None
+    store.close()
+    other.close()
@@ -0,0 +1,77 @@
+# timers.py — таймеры на хешированном колесе времени
+# Колесо — кольцо из slots ячеек по tick секунд; таймер лежит в ячейке
+# «номер тика срабатывания % slots» под своим ключом. Поставить, переставить
+# и отменить таймер — O(1) (словари), на каждом тике просматривается одна
+# ячейка, полного обхода всех сессий нет. Таймеры дальше одного оборота
+# колеса ждут в той же ячейке нужного круга.
+# Точность — один тик: таймер никогда не срабатывает раньше срока.
+
+import asyncio
+import logging
+import time
+
+from metrics import ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+class TimingWheel:
+    def __init__(self, tick=1.0, slots=4096, clock=time.monotonic):
+        self.tick = tick
+        self._clock = clock
+        self._start = clock()
+        self._current = 0  # последний обработанный тик
+        # Ячейки: ключ -> (тик срабатывания, данные)
+        self._slots = [{} for _ in range(slots)]
+        # ключ -> номер ячейки, для отмены за O(1)
+        self._slot_of = {}
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def __contains__(self, key):
+        return key in self._slot_of
+
+    def _tick_at(self, moment):
+        return int((moment - self._start) / self.tick)
+
+    def schedule(self, key, delay, payload=None):
+        # Таймер с тем же ключом переставляется
+        self.cancel(key)
+        # +1: округляем вверх, чтобы не сработать раньше срока
+        deadline = max(self._tick_at(self._clock() + delay) + 1, self._current + 1)
+        slot = deadline % len(self._slots)
+        self._slots[slot][key] = (deadline, payload)
+        self._slot_of[key] = slot
+
+    def cancel(self, key):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def advance(self):
+        # Сработавшие таймеры: [(ключ, данные)]; если цикл отстал — догоняем по тикам
+        target = self._tick_at(self._clock())
+        expired = []
+        while self._current < target:
+            self._current += 1
+            bucket = self._slots[self._current % len(self._slots)]
+            if not bucket:
+                continue
+            for key, (deadline, payload) in list(bucket.items()):
+                if deadline <= self._current:
+                    del bucket[key]
+                    del self._slot_of[key]
+                    expired.append((key, payload))
+        return expired
+
+    async def run(self, callback):
+        # callback(key, payload) — обычная функция; долгую работу пусть ставит задачей
+        while True:
+            await asyncio.sleep(self.tick)
+            for key, payload in self.advance():
+                try:
+                    callback(key, payload)
+                except Exception as e:
+                    ERRORS.inc("timer", type(e).__name__)
+                    logger.exception("Ошибка в обработчике таймера %r", key)
@@ -0,0 +1,104 @@
+# transport.py — HTTP-клиент для Bot API
+# Настраиваемый пул соединений, keep-alive, HTTP/2 (если установлен h2),
+# отдельный пул для getUpdates и статистика загрузки пула.
+
+import os
+import time
+
+import httpx
+from telegram.request import HTTPXRequest
+
+from metrics import API_ERRORS, API_RESPONSES, API_SECONDS
+
+
+def http2_available():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# === Запрос со статистикой пула ===
+class PooledRequest(HTTPXRequest):
+    def __init__(self, connection_pool_size=64, keepalive_expiry=30.0, http_version="1.1", **kwargs):
+        limits = httpx.Limits(
+            max_connections=connection_pool_size,
+            max_keepalive_connections=connection_pool_size,
+            keepalive_expiry=keepalive_expiry,
+        )
+        super().__init__(
+            connection_pool_size=connection_pool_size,
+            http_version=http_version,
+            httpx_kwargs={"limits": limits},
+            **kwargs,
+        )
+        self.pool_size = connection_pool_size
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        # Сколько запросов стартовало, когда все соединения уже были заняты
+        self.saturated = 0
+
+    async def do_request(self, url, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+        self.requests += 1
+        if self.in_flight >= self.pool_size:
+            self.saturated += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, *args, **kwargs)
+        except Exception as e:
+            API_ERRORS.inc(method, type(e).__name__)
+            raise
+        finally:
+            self.in_flight -= 1
+            API_SECONDS.observe(time.perf_counter() - started, method)
+        API_RESPONSES.inc(method, code)
+        return code, payload
+
+    def stats(self):
+        return {
+            "pool_size": self.pool_size,
+            "http_version": self.http_version,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "requests": self.requests,
+            "saturated": self.saturated,
+        }
+
+
+# === Настройки из окружения ===
+def _float(name, default):
+    return float(os.environ.get(name, default))
+
+
+def build_requests():
+    # BOT_API_HTTP2=auto (по умолчанию) — HTTP/2, если доступен пакет h2
+    http2 = os.environ.get("BOT_API_HTTP2", "auto")
+    use_http2 = http2_available() if http2 == "auto" else http2 in ("1", "true", "yes")
+    http_version = "2" if use_http2 else "1.1"
+    keepalive = _float("BOT_API_KEEPALIVE", 30)
+
+    # Обычные вызовы: короткие таймауты, большой пул
+    request = PooledRequest(
+        connection_pool_size=int(os.environ.get("BOT_API_POOL_SIZE", 64)),
+        keepalive_expiry=keepalive,
+        http_version=http_version,
+        connect_timeout=_float("BOT_API_CONNECT_TIMEOUT", 5),
+        read_timeout=_float("BOT_API_READ_TIMEOUT", 5),
+        write_timeout=_float("BOT_API_WRITE_TIMEOUT", 5),
+        pool_timeout=_float("BOT_API_POOL_TIMEOUT", 1),
+    )
+    # getUpdates — отдельный пул: long polling не занимает соединения обычных вызовов
+    # (время ожидания long polling PTB сам добавляет к read_timeout)
+    get_updates_request = PooledRequest(
+        connection_pool_size=1,
+        keepalive_expiry=keepalive,
+        connect_timeout=_float("BOT_API_CONNECT_TIMEOUT", 5),
+        read_timeout=_float("BOT_API_READ_TIMEOUT", 5),
+        pool_timeout=None,
+    )
+    return request, get_updates_request
@@ -0,0 +1,76 @@
+# update_processor.py — параллельная обработка обновлений
+# Обновления разных пользователей обрабатываются одновременно,
+# а обновления одного пользователя — строго по очереди (очередь на
+# пользователя), чтобы переходы index/answered в button_click и
+# next_question не гонялись.
+#
+# PTB занимает слот семафора (max_concurrent_updates) до вызова
+# do_process_update. Поэтому обновление, пришедшее, пока предыдущее этого же
+# пользователя ещё обрабатывается, не ждёт в слоте: оно встаёт в очередь
+# пользователя и сразу освобождает слот, а выполнит его задача, которая
+# обрабатывает первое. Один пользователь занимает не больше одного слота.
+
+import logging
+from collections import deque
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # user_id -> корутины, ждущие своей очереди (первая — выполняется)
+        self._queues = {}
+
+    @staticmethod
+    def _key(update):
+        # Таймеры (см. timers.py) передают вместо обновления просто user_id
+        if isinstance(update, int):
+            return update
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return update.effective_user.id
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            await coroutine
+            return
+
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append(coroutine)
+            return
+
+        queue = self._queues[key] = deque([coroutine])
+        try:
+            while queue:
+                try:
+                    await queue[0]
+                except Exception:
+                    # Ошибка одного обновления не должна задерживать следующие
+                    logger.exception("Ошибка при обработке обновления пользователя %s", key)
+                finally:
+                    queue.popleft()
+        finally:
+            # Очередь не нужна, когда она пуста — словарь не растёт
+            del self._queues[key]
+            for pending in queue:
+                # Отменили при остановке — недошедшие корутины закрываем
+                pending.close()
+
+    @property
+    def active_users(self):
+        return len(self._queues)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,125 @@
+# web.py — единый ASGI-сервер на $PORT
+# Отвечает на проверку "жив ли бот" и (в режиме webhook) принимает обновления
+# от Telegram, складывая их прямо в очередь Application.
+# С ADMIN_TOKEN (заголовок Authorization: Bearer <токен>) доступны /export
+# и /debug/profile.
+
+import asyncio
+import contextlib
+import hmac
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+from telegram import Update
+
+from export import ExportError, parse_filters
+from metrics import registry
+from monitor import ProfilerBusy, sample_stacks
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "jsonl": "application/x-ndjson"}
+MAX_PROFILE_SECONDS = 60
+
+
+async def home(request):
+    return HTMLResponse("<b>Бот работает!</b>")
+
+
+async def metrics(request):
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+def _authorized(request, token):
+    return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+
+
+def create_export_route(exporter, token):
+    # GET /export?kind=results&format=csv&quiz=product&since=2026-10-01&min_score=15
+    async def export(request):
+        if not _authorized(request, token):
+            return Response(status_code=403)
+        params = dict(request.query_params)
+        kind = params.pop("kind", "results")
+        fmt = params.pop("format", "csv")
+        quiz_id = params.pop("quiz", None)
+        try:
+            exporter.check(kind, fmt, quiz_id)
+            filters = parse_filters(params)
+        except ExportError as e:
+            return PlainTextResponse(str(e), status_code=400)
+        filename = exporter.filename(kind, fmt, quiz_id)
+        # Обычный генератор Starlette итерирует в пуле потоков — event loop не ждёт диск
+        return StreamingResponse(
+            exporter.stream(kind, fmt, quiz_id, **filters),
+            media_type=MEDIA_TYPES[fmt],
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+
+    return Route("/export", export)
+
+
+def create_profile_route(token):
+    # GET /debug/profile?seconds=10 — профиль живого процесса в формате collapsed stacks
+    async def profile(request):
+        if not _authorized(request, token):
+            return Response(status_code=403)
+        try:
+            seconds = float(request.query_params.get("seconds", 10))
+        except ValueError:
+            return PlainTextResponse("seconds: нужно число", status_code=400)
+        seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+        try:
+            # Сэмплирует отдельный поток; event loop в это время работает как обычно
+            stacks = await asyncio.to_thread(sample_stacks, seconds)
+        except ProfilerBusy as e:
+            return PlainTextResponse(str(e), status_code=409)
+        filename = f"profile-{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}.folded"
+        return PlainTextResponse(stacks, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+    return Route("/debug/profile", profile)
+
+
+def create_web_app(application, webhook_path=None, secret_token=None, exporter=None, admin_token=None):
+    async def telegram_webhook(request):
+        if secret_token and request.headers.get(SECRET_HEADER) != secret_token:
+            return Response(status_code=403)
+        try:
+            payload = await request.json()
+        except ValueError:
+            return Response(status_code=400)
+        if not isinstance(payload, dict):
+            return Response(status_code=400)
+        try:
+            update = Update.de_json(payload, application.bot)
+        except (KeyError, TypeError, ValueError):
+            # Объект без update_id или с полями не того типа
+            return Response(status_code=400)
+        await application.update_queue.put(update)
+        return Response()
+
+    routes = [
+        Route("/", home, methods=["GET", "HEAD"]),
+        Route("/metrics", metrics),
+    ]
+    if webhook_path:
+        routes.append(Route(webhook_path, telegram_webhook, methods=["POST"]))
+    if admin_token:
+        routes.append(create_profile_route(admin_token))
+        if exporter is not None:
+            routes.append(create_export_route(exporter, admin_token))
+    return Starlette(routes=routes)
+
+
+class WebServer(uvicorn.Server):
+    # Сигналы ловим сами (см. bot.serve), иначе uvicorn перевыбросит SIGTERM
+    # сразу после своей остановки и бот не успеет закрыться
+    @contextlib.contextmanager
+    def capture_signals(self):
+        yield
+
+    @classmethod
+    def for_app(cls, app, port):
+        return cls(uvicorn.Config(app, host="0.0.0.0", port=port, log_level="warning"))